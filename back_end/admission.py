@@ -0,0 +1,174 @@
+"""
+Admission control and deadlines for the question endpoints.
+
+At most ASK_MAX_IN_FLIGHT questions are answered at once, and at most
+ASK_MAX_QUEUED wait for a slot. Beyond that, a question is turned away
+straight away with 429. A queued question that gets no slot within
+ASK_QUEUE_TIMEOUT seconds gets 503. Both carry a Retry-After estimate.
+Under a burst the worker sheds load quickly instead of letting every
+request time out.
+
+Every admitted question gets an end-to-end deadline (ASK_DEADLINE_SECONDS).
+stage_deadline() bounds one stage by its own budget and by whatever is
+left of that deadline. Leaving the block by timeout cancels the upstream
+call inside it. Streamed answers get the same deadline and budgets through
+request_deadline_stream() and stage_deadline_stream().
+"""
+import os
+import math
+import time
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from metrics import ASK_IN_FLIGHT, ASK_QUEUED, ADMISSION_REJECTED, DEADLINE_EXCEEDED
+
+# --- Configuration ---
+ASK_MAX_IN_FLIGHT = int(os.getenv("ASK_MAX_IN_FLIGHT", 32))
+ASK_MAX_QUEUED = int(os.getenv("ASK_MAX_QUEUED", 64))
+ASK_QUEUE_TIMEOUT = float(os.getenv("ASK_QUEUE_TIMEOUT", 5))
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", 45))
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+# End of a stream, for anext()
+_END = object()
+
+
+class Overloaded(Exception):
+    """Raised instead of admitting a question. Carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded wait queue in front of it."""
+
+    def __init__(self, max_in_flight=ASK_MAX_IN_FLIGHT, max_queued=ASK_MAX_QUEUED, queue_timeout=ASK_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+        # Moving average of how long an admitted question holds its slot
+        self._service_time = 1.0
+
+    def retry_after(self):
+        """Seconds until the current queue should have drained, at the recent service time."""
+        return max(1, math.ceil(self._service_time * (self.queued + 1) / self.max_in_flight))
+
+    def check(self):
+        """Raises Overloaded (429) if a new question could not even join the queue."""
+        if self._slots.locked() and self.queued >= self.max_queued:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            raise Overloaded(429, self.retry_after(), "Too many questions are waiting")
+
+    @asynccontextmanager
+    async def admit(self):
+        """Holds an answer slot for the enclosed block, queueing for one if needed."""
+        self.check()
+        self.queued += 1
+        ASK_QUEUED.inc()
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await self._slots.acquire()
+        except TimeoutError:
+            ADMISSION_REJECTED.labels("queue_timeout").inc()
+            raise Overloaded(503, self.retry_after(), "No answer slot became free in time") from None
+        finally:
+            self.queued -= 1
+            ASK_QUEUED.dec()
+
+        self.in_flight += 1
+        ASK_IN_FLIGHT.inc()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self.in_flight -= 1
+            ASK_IN_FLIGHT.dec()
+            self._slots.release()
+
+
+@asynccontextmanager
+async def request_deadline(seconds=ASK_DEADLINE_SECONDS, when=None):
+    """
+    Bounds the enclosed block to `seconds`, or to the loop time `when`, and
+    makes that deadline visible to stage_deadline().
+    """
+    if when is None:
+        when = asyncio.get_running_loop().time() + seconds
+    token = _deadline.set(when)
+    try:
+        async with asyncio.timeout_at(when):
+            yield
+    except TimeoutError:
+        DEADLINE_EXCEEDED.labels("request").inc()
+        raise
+    finally:
+        _deadline.reset(token)
+
+
+@asynccontextmanager
+async def stage_deadline(stage, seconds=None):
+    """
+    Bounds one stage to `seconds` and to what is left of the request
+    deadline, if any. Raises TimeoutError when either runs out.
+    """
+    try:
+        async with asyncio.timeout_at(_stage_when(seconds)):
+            yield
+    except TimeoutError:
+        DEADLINE_EXCEEDED.labels(stage).inc()
+        raise
+
+
+def _stage_when(seconds):
+    when = _deadline.get()
+    if seconds is not None:
+        stage_when = asyncio.get_running_loop().time() + seconds
+        when = stage_when if when is None else min(when, stage_when)
+    return when
+
+
+# A timeout around a block that yields would fire in whatever the consumer
+# is doing at the time. Streams are bounded one item at a time instead, each
+# wait against the same deadline.
+
+async def request_deadline_stream(events, seconds=ASK_DEADLINE_SECONDS):
+    """request_deadline() for an async generator: bounds the waits for its items to one deadline."""
+    when = asyncio.get_running_loop().time() + seconds
+    try:
+        while True:
+            async with request_deadline(when=when):
+                event = await anext(events, _END)
+            if event is _END:
+                return
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def stage_deadline_stream(stage, items, seconds=None):
+    """stage_deadline() for an async generator: bounds the waits for its items to one stage budget."""
+    when = _stage_when(seconds)
+    try:
+        while True:
+            try:
+                async with asyncio.timeout_at(when):
+                    item = await anext(items, _END)
+            except TimeoutError:
+                DEADLINE_EXCEEDED.labels(stage).inc()
+                raise
+            if item is _END:
+                return
+            yield item
+    finally:
+        await items.aclose()
+
+
+admission = AdmissionController()
@@ -1,20 +1,28 @@
 import os
-import openai
 from dotenv import load_dotenv
 import asyncio
 import logging
 import re
 import sys
+import time
+from contextlib import aclosing
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from weaviate_db import search_chunks
+from vectordb import search_chunks_async
+from llm.llm_client import get_llm_client
+from embedding.cache import embedding_cache, normalize_text
+from sql.sql_executor import CubeStore
+from metrics import stage_timer, observe_answer, log_payload, current_request_id, STAGE_SECONDS, UPSTREAM_ERRORS
+from singleflight import SingleFlight
+from admission import stage_deadline, stage_deadline_stream
 from .prompt_manager import PromptManager
+from .answer_cache import AnswerCache
+from .context_builder import build_context, format_context_part, CONTEXT_SEPARATOR
+from .search_filter import question_filter, search_filter, question_facts
 
 # --- Configuration ---
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 load_dotenv(dotenv_path=dotenv_path)
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 # Initialize prompt manager
 prompt_manager = PromptManager()
 
@@ -26,6 +34,30 @@ MAX_TOKENS_ANSWER = prompt_manager.get_config('max_tokens_answer') or 1500
 MAX_TOKENS_TRANSLATE = prompt_manager.get_config('max_tokens_translate') or 150
 TEMPERATURE_ANSWER = prompt_manager.get_config('temperature_answer') or 1.0
 TEMPERATURE_TRANSLATE = prompt_manager.get_config('temperature_translate') or 1.0
+TRANSLATION_DEADLINE = prompt_manager.get_config('translation_deadline_seconds') or 5.0
+ANSWER_CACHE_ENABLED = prompt_manager.get_config('answer_cache_enabled') is not False
+ANSWER_CACHE_SIMILARITY = prompt_manager.get_config('answer_cache_similarity_threshold') or 0.95
+ANSWER_CACHE_TTL = prompt_manager.get_config('answer_cache_ttl_seconds') or 24 * 3600
+SQL_FAST_PATH_ENABLED = prompt_manager.get_config('sql_fast_path_enabled') is not False
+SQL_MAX_ROWS = prompt_manager.get_config('sql_max_rows') or 24
+CONTEXT_TOKEN_BUDGET = prompt_manager.get_config('context_token_budget') or 2000
+CONTEXT_MMR_LAMBDA = prompt_manager.get_config('context_mmr_lambda') or 0.7
+# Push the question's language, indicator and years down to the vector search
+SEARCH_FILTERS_ENABLED = prompt_manager.get_config('search_filters_enabled') is not False
+# Common questions embedded at startup so their first asks skip the embedding call
+PREWARM_QUESTIONS = prompt_manager.get_config('prewarm_questions') or []
+# Per-stage time budgets; each is also cut short by the request deadline (see admission.py)
+STAGE_BUDGETS = prompt_manager.get_config('stage_budget_seconds') or {}
+# Diversity needs the stored vectors; lambda 1.0 ranks by relevance alone
+INCLUDE_VECTORS = CONTEXT_MMR_LAMBDA < 1.0
+
+answer_cache = AnswerCache(similarity_threshold=ANSWER_CACHE_SIMILARITY, ttl=ANSWER_CACHE_TTL)
+cube_store = CubeStore(max_rows=SQL_MAX_ROWS)
+
+# Identical questions, translations and embeddings in flight at the same time share one call
+answer_flight = SingleFlight("answer")
+translation_flight = SingleFlight("translate")
+embedding_flight = SingleFlight("embed")
 
 logger = logging.getLogger(__name__)
 
@@ -35,28 +67,16 @@ def detect_language(text):
     """Detects if the text is primarily Arabic or English."""
     return 'ar' if re.search(r'[\u0600-\u06FF]', text) else 'en'
 
-async def call_openai_api(messages, model, max_tokens, temperature):
-    """Generic async wrapper for OpenAI Chat Completions API."""
-    loop = asyncio.get_event_loop()
+async def call_openai_api(messages, model, max_tokens, temperature, stage="completion"):
+    """Generic async wrapper for OpenAI Chat Completions API, bounded by the stage's budget."""
     try:
-        # Use max_completion_tokens for GPT-5 variants, max_tokens for other models
-        token_param = "max_completion_tokens" if "gpt-5" in model else "max_tokens"
-        kwargs = {
-            "model": model,
-            "messages": messages,
-            token_param: max_tokens,
-        }
-        
-        # Only add temperature parameter for non-GPT-5 models
-        if "gpt-5" not in model:
-            kwargs["temperature"] = temperature
-        
-        response = await loop.run_in_executor(
-            None,
-            lambda: openai.chat.completions.create(**kwargs)
-        )
-        return response.choices[0].message.content.strip()
+        async with stage_deadline(stage, STAGE_BUDGETS.get(stage)):
+            return await get_llm_client().chat(messages, model, max_tokens, temperature)
+    except TimeoutError:
+        logger.error(f"OpenAI {stage} call for model {model} ran out of time")
+        return None
     except Exception as e:
+        UPSTREAM_ERRORS.labels("openai", "chat").inc()
         logger.error(f"OpenAI API call failed for model {model}: {e}")
         return None
 
@@ -70,91 +90,342 @@ async def translate_text(text, target_language):
         {"role": "system", "content": translation_prompt},
         {"role": "user", "content": text}
     ]
-    return await call_openai_api(messages, LLM_MODEL, MAX_TOKENS_TRANSLATE, TEMPERATURE_TRANSLATE)
+    with stage_timer("translate"):
+        return await translation_flight.do(
+            (normalize_text(text), target_language),
+            lambda: call_openai_api(messages, LLM_MODEL, MAX_TOKENS_TRANSLATE, TEMPERATURE_TRANSLATE, "translate"),
+        )
+
+async def embed_queries(queries):
+    """
+    Generates embeddings for several queries. Cached ones are served from the
+    cache, ones already being embedded for another request are shared, and
+    the rest are embedded together in a single API request.
+    Failed embeddings are returned as None.
+    """
+    embeddings = [await embedding_cache.get(EMBEDDING_MODEL, query) for query in queries]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if not missing:
+        return embeddings
+    texts = {normalize_text(queries[i]): queries[i] for i in missing}
+
+    async def fetch(keys):
+        vectors = await get_llm_client().embed([texts[key] for key in keys], EMBEDDING_MODEL)
+        for key, vector in zip(keys, vectors):
+            await embedding_cache.set(EMBEDDING_MODEL, texts[key], vector)
+        return vectors
 
-async def embed_query(question):
-    """Generates an embedding for a given query."""
-    loop = asyncio.get_event_loop()
     try:
-        resp = await loop.run_in_executor(
-            None,
-            lambda: openai.embeddings.create(model=EMBEDDING_MODEL, input=[question])
-        )
-        return resp.data[0].embedding
+        with stage_timer("embed"):
+            async with stage_deadline("embed", STAGE_BUDGETS.get("embed")):
+                vectors = await embedding_flight.do_many([normalize_text(queries[i]) for i in missing], fetch)
+    except TimeoutError:
+        logger.error(f"Request {current_request_id()}: embedding of {len(missing)} queries ran out of time")
+        return embeddings
     except Exception as e:
-        logger.error(f"Embedding failed for query '{question}': {e}")
-        return None
+        UPSTREAM_ERRORS.labels("openai", "embed").inc()
+        logger.error(f"Request {current_request_id()}: embedding of {len(missing)} queries failed: {e}")
+        return embeddings
+    for i, vector in zip(missing, vectors):
+        embeddings[i] = vector
+    return embeddings
+
+async def embed_query(question):
+    """Generates an embedding for a given query, served from the cache when possible."""
+    return (await embed_queries([question]))[0]
 
-async def search_and_combine_chunks(original_query, translated_query):
+async def search_query(query, embedding=None, where=None):
     """
-    Performs vector search with both original and translated queries,
-    then combines and deduplicates the results.
+    Embeds a single query (unless its embedding is given) and searches for
+    it. A filtered search that finds nothing is repeated without the filter.
     """
-    # Embed both queries concurrently
-    original_embedding, translated_embedding = await asyncio.gather(
-        embed_query(original_query),
-        embed_query(translated_query)
-    )
-    
-    # Search for chunks concurrently
-    original_chunks, translated_chunks = await asyncio.gather(
-        asyncio.to_thread(search_chunks, original_embedding, top_k=SEARCH_TOP_K),
-        asyncio.to_thread(search_chunks, translated_embedding, top_k=SEARCH_TOP_K)
-    )
+    if embedding is None:
+        embedding = await embed_query(query)
+    if embedding is None:
+        return []
+    try:
+        with stage_timer("search"):
+            async with stage_deadline("search", STAGE_BUDGETS.get("search")):
+                chunks = await search_chunks_async(
+                    embedding, top_k=SEARCH_TOP_K, where=where, include_vector=INCLUDE_VECTORS
+                )
+                if where and not chunks:
+                    logger.info("No chunks matched the search filter, searching unfiltered")
+                    chunks = await search_chunks_async(embedding, top_k=SEARCH_TOP_K, include_vector=INCLUDE_VECTORS)
+                return chunks
+    except TimeoutError:
+        logger.error(f"Request {current_request_id()}: search ran out of time")
+        return []
 
-    # Combine and deduplicate chunks
-    combined = {chunk['properties']['text']: chunk for chunk in original_chunks}
-    for chunk in translated_chunks:
-        combined[chunk['properties']['text']] = chunk
-        
-    return list(combined.values())
+def _distance(chunk):
+    distance = chunk.get('distance')
+    return float('inf') if distance is None else distance
 
-async def answer_user_question_async(question):
+def combine_chunks(*chunk_lists):
     """
-    Main pipeline to answer a user's question asynchronously.
-    Returns a dictionary with the answer and a list of sources.
+    Fuses several search results. A chunk found by more than one query keeps
+    its best (smallest) distance, and the result is ordered by that distance.
     """
-    original_lang = detect_language(question)
-    target_lang = 'ar' if original_lang == 'en' else 'en'
-    
+    best = {}
+    for chunks in chunk_lists:
+        for chunk in chunks:
+            key = chunk['properties']['text']
+            if key not in best or _distance(chunk) < _distance(best[key]):
+                best[key] = chunk
+    return sorted(best.values(), key=_distance)
+
+def retrieval_filters(question, target_lang):
+    """(original_where, translated_where) for the two retrieval branches, or Nones without SEARCH_FILTERS_ENABLED."""
+    if not SEARCH_FILTERS_ENABLED:
+        return None, None
+    conditions = question_filter(question)
+    return search_filter(conditions, detect_language(question)), search_filter(conditions, target_lang)
+
+async def translated_retrieval(question, target_lang):
+    """The translated branch of retrieve_chunks(): translate, then embed and search the translation."""
     translated_question = await translate_text(question, target_lang)
     if not translated_question:
-        logger.warning(f"Translation failed for: {question}")
-        return {
-            "answer": prompt_manager.get_error_message('translation_failed', original_lang),
-            "sources": []
-        }
+        logger.warning(f"Request {current_request_id()}: translation failed, searching in the original language only")
+        return None
+    return await search_query(translated_question, where=retrieval_filters(question, target_lang)[1])
 
-    all_chunks = await search_and_combine_chunks(question, translated_question)
-    logger.info(f"Retrieved chunks: {all_chunks}")
-    
-    context_parts = []
-    for chunk in all_chunks:
-        source = chunk["properties"].get("source", "N/A")
-        text = chunk["properties"].get("text", "")
-        context_parts.append(f"Source: {source}\nContent: {text}")
-    context_text = "\n\n---\n\n".join(context_parts)
+async def retrieve_chunks(question, target_lang, question_embedding=None, translated_task=None):
+    """
+    Retrieves context for a question as a small dependency graph:
+
+        original embed -> original search ---------------------\
+        translate -> translated embed -> translated search -----> combine
+
+    The original-language branch starts immediately, without waiting for the
+    translation. The translated branch joins if it finishes within
+    TRANSLATION_DEADLINE seconds; otherwise it is cancelled and only the
+    original-language hits are used. A caller that started the translated
+    branch earlier (see prepare_answer) passes it in as `translated_task`.
+
+    With SEARCH_FILTERS_ENABLED, each branch searches only chunks in its
+    own language, further narrowed by the indicators and years the question
+    names (see search_filter.py).
+
+    Returns (original_chunks, translated_chunks); translated_chunks is None
+    when the translation failed or missed the deadline.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + TRANSLATION_DEADLINE
+
+    original_where, _ = retrieval_filters(question, target_lang)
+    original_task = asyncio.create_task(search_query(question, question_embedding, where=original_where))
+    if translated_task is None:
+        translated_task = asyncio.create_task(translated_retrieval(question, target_lang))
+    try:
+        original_chunks = await original_task
+        try:
+            translated_chunks = await asyncio.wait_for(
+                translated_task, timeout=max(0.0, deadline - loop.time())
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Request {current_request_id()}: translated retrieval missed the {TRANSLATION_DEADLINE}s "
+                "deadline, answering from original-language hits"
+            )
+            translated_chunks = None
+    finally:
+        # Nothing is left running if a branch failed or the caller was cancelled
+        original_task.cancel()
+        translated_task.cancel()
+
+    return original_chunks, translated_chunks
+
+async def warm_up():
+    """
+    Opens the caches and the cube catalogue and pre-embeds PREWARM_QUESTIONS,
+    which also opens the OpenAI connection pool, so the first questions after
+    startup are not slower than the rest.
+    """
+    await embedding_cache.open()
+    if ANSWER_CACHE_ENABLED:
+        await answer_cache.open()
+        await asyncio.to_thread(cube_store.place_names)
+    if SQL_FAST_PATH_ENABLED:
+        await asyncio.to_thread(cube_store.catalogue)
+    if PREWARM_QUESTIONS:
+        embeddings = await embed_queries(PREWARM_QUESTIONS)
+        embedded = sum(embedding is not None for embedding in embeddings)
+        logger.info(f"Pre-embedded {embedded}/{len(PREWARM_QUESTIONS)} common questions")
+
+def build_answer_messages(question, all_chunks, original_lang):
+    """Builds the chat messages for the final answer from the retrieved chunks."""
+    context_text = CONTEXT_SEPARATOR.join(format_context_part(chunk) for chunk in all_chunks)
 
     prompt = f"{context_text}\n\nQuestion: {question}\nAnswer:"
-    logger.info(f"Full prompt sent to LLM: {prompt}")
-    
+    log_payload("prompt", prompt)
+
     # Get system prompt in the user's language
     system_prompt = prompt_manager.get_system_prompt(original_lang)
     
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": prompt}
     ]
+
+async def prepare_answer(question):
+    """
+    Runs every step before the final completion: the SQL fast path for
+    direct indicator lookups, answer cache lookup, translation and retrieval.
+    Returns a dictionary with the question's 'language', 'embedding' and
+    'route' (sql, cache, rag or error), plus either a finished 'result' (lookup, cache hit or failure) or the
+    'messages' and 'sources' for the answer model.
+    """
+    original_lang = detect_language(question)
+    target_lang = 'ar' if original_lang == 'en' else 'en'
+    prepared = {"language": original_lang, "embedding": None, "route": "rag"}
+
+    if SQL_FAST_PATH_ENABLED:
+        # "PMI for March 2024" needs one indexed query, not retrieval and a completion
+        with stage_timer("sql"):
+            structured = await cube_store.answer_async(question, original_lang)
+        if structured:
+            prepared["result"] = structured
+            prepared["route"] = "sql"
+            return prepared
+
+    # Translation is the slowest step; start it now rather than after the cache lookup
+    translated_task = asyncio.create_task(translated_retrieval(question, target_lang))
+    try:
+        if ANSWER_CACHE_ENABLED:
+            prepared["embedding"] = await embed_query(question)
+            with stage_timer("answer_cache"):
+                # Years, numbers, indicators and places must match too, not just the embedding
+                prepared["facts"] = await asyncio.to_thread(cache_facts, question)
+                cached = await answer_cache.lookup(prepared["embedding"], original_lang, prepared["facts"])
+            if cached:
+                logger.info(f"Answer cache hit (similarity {cached['similarity']:.3f})")
+                prepared["result"] = {"answer": cached["answer"], "sources": cached["sources"]}
+                prepared["route"] = "cache"
+                return prepared
+
+        original_chunks, translated_chunks = await retrieve_chunks(
+            question, target_lang, prepared["embedding"], translated_task
+        )
+    finally:
+        # A cache hit, or a failure, leaves the translation unused
+        translated_task.cancel()
+    if translated_chunks is None and not original_chunks:
+        prepared["result"] = {
+            "answer": prompt_manager.get_error_message('translation_failed', original_lang),
+            "sources": []
+        }
+        prepared["route"] = "error"
+        return prepared
+
+    all_chunks = combine_chunks(original_chunks, translated_chunks or [])
+    with stage_timer("context"):
+        context_chunks, prepared["context"] = build_context(
+            all_chunks, original_lang, CONTEXT_TOKEN_BUDGET, CONTEXT_MMR_LAMBDA
+        )
+    context = prepared["context"]
+    logger.info(
+        f"Context: kept {context['kept']}/{context['candidates']} chunks "
+        f"({context['duplicates']} duplicates), {context['tokens_after']} tokens, "
+        f"saved {context['tokens_saved']} of {context['tokens_before']}"
+    )
+
+    prepared["messages"] = build_answer_messages(question, context_chunks, original_lang)
+    prepared["sources"] = list(set([chunk["properties"].get("source", "N/A") for chunk in context_chunks]))
+    return prepared
+
+def cache_facts(question):
+    """question_facts() with the city and sector names from the cube database."""
+    return question_facts(question, cube_store.place_names())
+
+async def remember_answer(question, prepared, answer):
+    if ANSWER_CACHE_ENABLED:
+        await answer_cache.store(
+            question, prepared["language"], prepared["embedding"], answer, prepared["sources"], prepared.get("facts")
+        )
+
+async def answer_user_question_async(question):
+    """
+    Main pipeline to answer a user's question asynchronously.
+    Returns a dictionary with the answer and a list of sources.
+
+    Concurrent requests for the same question (after normalization) share
+    one run of the pipeline and all receive its result.
+    """
+    key = (normalize_text(question), detect_language(question))
+    return await answer_flight.do(key, lambda: _answer_user_question(question))
+
+async def _answer_user_question(question):
+    started = time.perf_counter()
+    prepared = await prepare_answer(question)
+    if "result" in prepared:
+        observe_answer(prepared["route"], started)
+        return prepared["result"]
     
-    answer = await call_openai_api(messages, LLM_MODEL, MAX_TOKENS_ANSWER, TEMPERATURE_ANSWER)
+    with stage_timer("completion"):
+        answer = await call_openai_api(prepared["messages"], LLM_MODEL, MAX_TOKENS_ANSWER, TEMPERATURE_ANSWER)
     
     if not answer:
+        observe_answer("error", started)
         return {
-            "answer": prompt_manager.get_error_message('api_failed', original_lang),
+            "answer": prompt_manager.get_error_message('api_failed', prepared["language"]),
             "sources": []
         }
         
+    await remember_answer(question, prepared, answer)
+    observe_answer("rag", started)
     return {
         "answer": answer,
-        "sources": list(set([chunk["properties"].get("source", "N/A") for chunk in all_chunks]))
+        "sources": prepared["sources"]
     }
+
+async def stream_answer_async(question):
+    """
+    Streaming variant of answer_user_question_async. Yields (event, data)
+    pairs: 'sources' once retrieval is done, 'token' for each piece of the
+    answer as it arrives, then 'done' (or 'error'). Closing the generator
+    cancels the upstream completion.
+    """
+    started = time.perf_counter()
+    prepared = await prepare_answer(question)
+    if "result" in prepared:
+        observe_answer(prepared["route"], started)
+        yield "sources", prepared["result"]["sources"]
+        yield "token", prepared["result"]["answer"]
+        yield "done", {}
+        return
+
+    yield "sources", prepared["sources"]
+
+    parts = []
+    # Observed for finished streams only; a client leaving mid-answer is not a completion time
+    completion_started = time.perf_counter()
+    try:
+        deltas = stage_deadline_stream("completion", get_llm_client().stream_chat(
+            prepared["messages"], LLM_MODEL, MAX_TOKENS_ANSWER, TEMPERATURE_ANSWER
+        ), STAGE_BUDGETS.get("completion"))
+        async with aclosing(deltas):
+            async for delta in deltas:
+                parts.append(delta)
+                yield "token", delta
+    except TimeoutError:
+        logger.error(f"OpenAI streaming completion for model {LLM_MODEL} ran out of time")
+        observe_answer("error", started)
+        yield "error", prompt_manager.get_error_message('api_failed', prepared["language"])
+        return
+    except Exception as e:
+        UPSTREAM_ERRORS.labels("openai", "stream_chat").inc()
+        logger.error(f"OpenAI streaming call failed for model {LLM_MODEL}: {e}")
+        observe_answer("error", started)
+        yield "error", prompt_manager.get_error_message('api_failed', prepared["language"])
+        return
+
+    answer = "".join(parts).strip()
+    if not answer:
+        observe_answer("error", started)
+        yield "error", prompt_manager.get_error_message('api_failed', prepared["language"])
+        return
+
+    STAGE_SECONDS.labels("completion").observe(time.perf_counter() - completion_started)
+    await remember_answer(question, prepared, answer)
+    observe_answer("rag", started)
+    yield "done", {}
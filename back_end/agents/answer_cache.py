@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import aiosqlite
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from embedding.cache import CACHE_DB_PATH, pack_vector, unpack_vector
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 1000
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class AnswerCache:
+    """Semantic cache of final answers for near-duplicate questions.
+
+    Entries live in the shared SQLite cache database so every worker can serve
+    answers computed by the others. Each worker keeps a per-language matrix of
+    normalized question embeddings and answers a lookup with one matrix-vector
+    product. A stored answer is returned when its question's cosine similarity
+    is at or above the threshold and the language matches. Questions that
+    differ only in a year or a city embed almost identically, so a lookup
+    can also pass the question's facts (search_filter.question_facts); then
+    only an entry with the same facts counts as a hit.
+
+    The pipeline calls invalidate() after uploading new data. That bumps a data
+    version in SQLite, which tells every worker to drop its in-memory copy.
+    """
+
+    def __init__(
+        self,
+        db_path=CACHE_DB_PATH,
+        similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+        ttl=DEFAULT_TTL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ):
+        self.db_path = db_path
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = None
+        self._lock = asyncio.Lock()
+        self._data_version = None
+        self._max_id = 0
+        # language -> {"matrix": np.ndarray, "entries": [dict, ...]}
+        self._by_language = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _get_db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = await aiosqlite.connect(self.db_path, timeout=5)
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " language TEXT NOT NULL,"
+                " question TEXT NOT NULL,"
+                " embedding BLOB NOT NULL,"
+                " answer TEXT NOT NULL,"
+                " sources TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " facts TEXT)"
+            )
+            async with db.execute("PRAGMA table_info(answer_cache)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if "facts" not in columns:
+                # Rows cached before facts were recorded never match a lookup with facts
+                await db.execute("ALTER TABLE answer_cache ADD COLUMN facts TEXT")
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            await db.execute(
+                "INSERT OR IGNORE INTO cache_meta (key, value) VALUES ('data_version', '0')"
+            )
+            await db.commit()
+            self._db = db
+        return self._db
+
+    def _reset_memory(self):
+        self._by_language = {}
+        self._max_id = 0
+
+    def _extend(self, language, rows):
+        """Adds rows of (id, question, embedding, answer, sources, created_at, facts), copying the matrix once."""
+        bucket = self._by_language.setdefault(language, {"matrix": None, "entries": []})
+        # Only the newest max_entries rows can survive the trim below
+        rows = rows[-self.max_entries:]
+        vectors = _normalize(np.array([row[2] for row in rows], dtype=np.float32))
+        bucket["matrix"] = vectors if bucket["matrix"] is None else np.vstack([bucket["matrix"], vectors])
+        bucket["entries"].extend(
+            {
+                "id": row_id,
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "created_at": created_at,
+                "facts": facts,
+            }
+            for row_id, question, _, answer, sources, created_at, facts in rows
+        )
+        if len(bucket["entries"]) > self.max_entries:
+            overflow = len(bucket["entries"]) - self.max_entries
+            bucket["matrix"] = bucket["matrix"][overflow:]
+            bucket["entries"] = bucket["entries"][overflow:]
+        self._max_id = max(self._max_id, rows[-1][0])
+
+    async def _sync(self):
+        """Picks up invalidations and entries written by other workers."""
+        db = await self._get_db()
+        async with db.execute("SELECT value FROM cache_meta WHERE key = 'data_version'") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version != self._data_version:
+            self._reset_memory()
+            self._data_version = version
+
+        async with db.execute(
+            "SELECT id, language, question, embedding, answer, sources, created_at, facts "
+            "FROM answer_cache WHERE id > ? AND created_at >= ? ORDER BY id",
+            (self._max_id, time.time() - self.ttl),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        by_language = {}
+        for row_id, language, question, blob, answer, sources, created_at, facts in rows:
+            by_language.setdefault(language, []).append(
+                (row_id, question, unpack_vector(blob), answer, json.loads(sources), created_at, facts)
+            )
+        for language, language_rows in by_language.items():
+            self._extend(language, language_rows)
+
+    async def open(self):
+        """Opens the database and loads the stored answers ahead of the first lookup."""
+        async with self._lock:
+            await self._sync()
+
+    async def lookup(self, embedding, language, facts=None):
+        """
+        Returns a cached {"answer", "sources", ...} for a near-duplicate
+        question, or None. With `facts`, only entries stored with the same
+        facts are considered.
+        """
+        if embedding is None:
+            return None
+        try:
+            async with self._lock:
+                await self._sync()
+            bucket = self._by_language.get(language)
+            if bucket and bucket["entries"]:
+                query = _normalize(np.asarray(embedding, dtype=np.float32))
+                similarities = bucket["matrix"] @ query
+                now = time.time()
+                excluded = np.array([
+                    now - e["created_at"] >= self.ttl or (facts is not None and e["facts"] != facts)
+                    for e in bucket["entries"]
+                ])
+                similarities[excluded] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.hits += 1
+                    CACHE_REQUESTS.labels("answer", "hit").inc()
+                    return {**bucket["entries"][best], "similarity": float(similarities[best])}
+        except Exception as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+        self.misses += 1
+        CACHE_REQUESTS.labels("answer", "miss").inc()
+        return None
+
+    async def store(self, question, language, embedding, answer, sources, facts=None):
+        if embedding is None:
+            return
+        try:
+            async with self._lock:
+                db = await self._get_db()
+                now = time.time()
+                await db.execute(
+                    "INSERT INTO answer_cache (language, question, embedding, answer, sources, created_at, facts) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (language, question, pack_vector(embedding), answer,
+                     json.dumps(sources, ensure_ascii=False), now, facts),
+                )
+                await db.execute(
+                    "DELETE FROM answer_cache WHERE created_at < ? OR id IN ("
+                    " SELECT id FROM answer_cache WHERE language = ? ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                    (now - self.ttl, language, self.max_entries),
+                )
+                # The next _sync() loads the new row, keeping ids contiguous across workers
+                await db.commit()
+        except Exception as e:
+            logger.warning(f"Answer cache write failed: {e}")
+
+    async def invalidate(self):
+        """Drops every cached answer, in this worker and all others."""
+        async with self._lock:
+            db = await self._get_db()
+            await db.execute("DELETE FROM answer_cache")
+            await db.execute(
+                "UPDATE cache_meta SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT) "
+                "WHERE key = 'data_version'"
+            )
+            await db.commit()
+            self._reset_memory()
+            self._data_version = None
+        logger.info("Answer cache invalidated")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": sum(len(b["entries"]) for b in self._by_language.values()),
+        }
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
@@ -0,0 +1,156 @@
+import re
+import logging
+import numpy as np
+from llm.llm_client import estimate_tokens
+from sql.metadata import normalize, parse_period, CUBE_TABLES, DIMENSION_PROPERTIES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_MMR_LAMBDA = 0.7
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+_LOCALE_SUFFIX = re.compile(r"\.(en|ar)\.json$")
+
+
+def format_context_part(chunk):
+    """How one chunk appears in the answer prompt."""
+    properties = chunk["properties"]
+    return f"Source: {properties.get('source', 'N/A')}\nContent: {properties.get('text', '')}"
+
+
+def chunk_tokens(chunk):
+    return estimate_tokens(format_context_part(chunk) + CONTEXT_SEPARATOR)
+
+
+def _cube(chunk):
+    """'pmi.en.json' -> 'pmi'; None for chunks that did not come from an API cube."""
+    source = chunk["properties"].get("source") or ""
+    match = _LOCALE_SUFFIX.search(source)
+    return source[:match.start()] if match else None
+
+
+def _language(chunk):
+    properties = chunk["properties"]
+    if properties.get("language"):
+        return properties["language"]
+    match = _LOCALE_SUFFIX.search(properties.get("source") or "")
+    return match.group(1) if match else None
+
+
+def _period(chunk):
+    return parse_period(chunk["properties"].get("text", ""))
+
+
+def duplicate_key(chunk):
+    """
+    Chunks with the same key say the same thing. Cube records are keyed by
+    their structured properties: the cube, the period and the city or
+    sector, so records for different places never collapse, whatever their
+    figures. The English and Arabic renderings of a record share that key
+    unless it has a (localized) city or sector name. Any other chunk, or a
+    record of a cube with a dimension the chunks do not carry, is only a
+    duplicate of an identical text.
+    """
+    properties = chunk["properties"]
+    spec = CUBE_TABLES.get(properties.get("cube"))
+    if spec is None or not properties.get("year") or any(d not in DIMENSION_PROPERTIES for d in spec["dimensions"]):
+        return ("text", " ".join(normalize(properties.get("text", "")).split()))
+    dimensions = tuple(
+        normalize(properties.get(prop) or "") for prop in sorted(set(DIMENSION_PROPERTIES.values()))
+    )
+    return ("cube", properties["cube"], properties["year"], properties.get("quarter"), properties.get("month"), dimensions)
+
+
+def _distance(chunk):
+    distance = chunk.get("distance")
+    return float("inf") if distance is None else distance
+
+
+def collapse_duplicates(chunks, language):
+    """
+    Keeps one chunk per duplicate_key(), preferring the question's language.
+    The survivor takes the group's best distance.
+    """
+    kept = {}
+    for chunk in sorted(chunks, key=_distance):
+        key = duplicate_key(chunk)
+        if key not in kept:
+            kept[key] = chunk
+        elif _language(chunk) == language and _language(kept[key]) != language:
+            kept[key] = {**chunk, "distance": _distance(kept[key])}
+    return sorted(kept.values(), key=_distance)
+
+
+def mmr_select(chunks, token_budget, mmr_lambda):
+    """
+    Greedy maximal marginal relevance under a token budget: each step takes
+    the chunk with the best mix of relevance (1 - distance) and novelty
+    (1 - its highest similarity to what is already selected). Chunks that do
+    not fit in the remaining budget are skipped. Without vectors this is
+    plain relevance order.
+    """
+    if not chunks:
+        return []
+    relevance = np.array([1.0 - _distance(c) if c.get("distance") is not None else 0.0 for c in chunks])
+    vectors = None
+    if mmr_lambda < 1.0 and all(c.get("vector") is not None for c in chunks):
+        vectors = np.asarray([c["vector"] for c in chunks], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    redundancy = np.zeros(len(chunks))
+    remaining = np.ones(len(chunks), dtype=bool)
+    selected, used = [], 0
+    while remaining.any():
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * redundancy if vectors is not None else relevance.copy()
+        scores[~remaining] = -np.inf
+        best = int(np.argmax(scores))
+        remaining[best] = False
+        tokens = chunk_tokens(chunks[best])
+        if used + tokens > token_budget and selected:
+            continue
+        selected.append(best)
+        used += tokens
+        if vectors is not None:
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return [chunks[i] for i in selected]
+
+
+def order_for_prompt(chunks):
+    """
+    Groups chunks from the same source, in order of each group's most
+    relevant chunk, and lists a cube's records chronologically within it.
+    """
+    groups = {}
+    for chunk in chunks:
+        groups.setdefault(chunk["properties"].get("source"), []).append(chunk)
+    ordered = []
+    for group in groups.values():
+        if _cube(group[0]) is not None:
+            group = sorted(group, key=_period)
+        ordered.extend(group)
+    return ordered
+
+
+def build_context(chunks, language, token_budget=DEFAULT_TOKEN_BUDGET, mmr_lambda=DEFAULT_MMR_LAMBDA):
+    """
+    Picks and orders the chunks for the answer prompt: cross-language
+    duplicates are collapsed, MMR picks a relevant but diverse subset within
+    token_budget, and the result is grouped by source.
+
+    Returns (chunks, stats) where stats reports the tokens saved.
+    """
+    tokens_before = sum(chunk_tokens(chunk) for chunk in chunks)
+    unique = collapse_duplicates(chunks, language)
+    selected = order_for_prompt(mmr_select(unique, token_budget, mmr_lambda))
+    tokens_after = sum(chunk_tokens(chunk) for chunk in selected)
+    stats = {
+        "candidates": len(chunks),
+        "duplicates": len(chunks) - len(unique),
+        "kept": len(selected),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+    return selected, stats
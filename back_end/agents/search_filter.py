@@ -0,0 +1,63 @@
+import re
+import json
+from sql.metadata import normalize, find_years, find_month, find_quarter
+from sql.sql_generator import match_topics, contains_phrase
+from vectordb.filters import equal, between, contains_any, all_of, any_of
+
+# "since 2020" / "منذ 2020" leave the range open-ended after the year, "before 2020" before it
+_OPEN_AFTER = re.compile(r"(?:\bsince|\bafter|\bfrom|منذ|بعد)\s+(?:عام\s+|سنه\s+)?((?:19|20)\d\d)(?!\d)")
+_OPEN_BEFORE = re.compile(r"(?:\bbefore|\buntil|\bup to|قبل|حتي)\s+(?:عام\s+|سنه\s+)?((?:19|20)\d\d)(?!\d)")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def question_years(text):
+    """(first, last) year a normalized question asks about; either may be None for an open range."""
+    years = find_years(text)
+    if not years:
+        return None, None
+    if len(years) == 1:
+        if _OPEN_AFTER.search(text):
+            return years[0], None
+        if _OPEN_BEFORE.search(text):
+            return None, years[0]
+    return min(years), max(years)
+
+
+def question_filter(question):
+    """
+    Narrows API record chunks to the indicators and years named in the
+    question. Website chunks carry neither, so they always stay candidates.
+    Returns None when the question names neither.
+    """
+    text = normalize(question)
+    topics = match_topics(text)
+    first, last = question_years(text)
+    records = all_of(
+        contains_any("topic", topics) if topics else None,
+        between("year", first, last) if first or last else None,
+    )
+    if records is None:
+        return None
+    return any_of(equal("type", "page"), records)
+
+
+def question_facts(question, place_names=()):
+    """
+    The specifics of a question that its embedding barely reflects: numbers
+    (years included), month, quarter, indicators and the places it names
+    out of `place_names`. Returned as a canonical string, so two questions
+    have equal facts exactly when they ask about the same figures.
+    """
+    text = normalize(question)
+    return json.dumps([
+        sorted(set(_NUMBER.findall(text))),
+        find_month(text),
+        find_quarter(text),
+        sorted(match_topics(text)),
+        sorted({normalize(name) for name in place_names if contains_phrase(text, name)}),
+    ], ensure_ascii=False)
+
+
+def search_filter(question_conditions, language):
+    """Combines question_filter() with the language of the query being searched."""
+    return all_of(equal("language", language), question_conditions)
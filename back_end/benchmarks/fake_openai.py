@@ -0,0 +1,155 @@
+"""
+Minimal OpenAI-compatible server for offline benchmarks.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with a
+configurable latency and jitter, so the answer path can be load-tested with
+no network and no API key. Embeddings are deterministic bag-of-words hashes:
+texts that share words get similar vectors, which is enough for retrieval
+over a corpus embedded with fake_embedding() to return related chunks.
+
+    python back_end/benchmarks/fake_openai.py --port 8900 --chat-latency-ms 800 --jitter-ms 200
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_DIM = 3072  # text-embedding-3-large
+
+_WORD = re.compile(r"\w+")
+
+
+def fake_embedding(text, dim=DEFAULT_DIM):
+    """Feature-hashed bag of words, L2-normalized. Same text, same vector."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD.findall(text.casefold()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def _tokens(text):
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def create_app(chat_latency=0.8, embedding_latency=0.05, jitter=0.1, error_rate=0.0,
+               answer_words=120, dim=DEFAULT_DIM):
+    """Builds the fake server. Latencies are in seconds; jitter is the standard deviation."""
+    app = FastAPI()
+    answer = " ".join(["The", "**index**", "rose", "to", "**57.2**", "in", "March", "2024."] * (answer_words // 8 + 1))
+    answer = " ".join(answer.split()[:answer_words])
+
+    def delay(mean):
+        return max(0.0, random.gauss(mean, jitter))
+
+    def rate_limited():
+        if error_rate and random.random() < error_rate:
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                headers={"retry-after-ms": "100"},
+            )
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        if (error := rate_limited()) is not None:
+            return error
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(delay(embedding_latency))
+        tokens = sum(_tokens(text) for text in texts)
+        return {
+            "object": "list",
+            "model": body["model"],
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, dim).tolist()}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        if (error := rate_limited()) is not None:
+            return error
+        body = await request.json()
+        prompt_tokens = sum(_tokens(m.get("content") or "") for m in body["messages"])
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _tokens(answer),
+            "total_tokens": prompt_tokens + _tokens(answer),
+        }
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(chat_latency))
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        async def events():
+            # The completion time is spread evenly over the streamed words
+            words = answer.split(" ")
+            interval = delay(chat_latency) / len(words)
+            for i, word in enumerate(words):
+                await asyncio.sleep(interval)
+                chunk = {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chat-latency-ms", type=float, default=800)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--answer-words", type=int, default=120)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    args = parser.parse_args()
+
+    app = create_app(
+        chat_latency=args.chat_latency_ms / 1000,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        answer_words=args.answer_words,
+        dim=args.dim,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
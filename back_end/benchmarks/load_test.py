@@ -0,0 +1,262 @@
+"""
+Offline load test of /api/ask.
+
+Starts the app from back_end/main.py with uvicorn against local stand-ins:
+the fake OpenAI server in fake_openai.py and a NumPy vector store filled
+with a synthetic corpus, all in a temporary directory. It then sends
+questions at a fixed concurrency and reports throughput plus p50/p95/p99
+latency, end to end and per stage. Per-stage timings come from the
+Server-Timing header the app sets on every answer.
+
+    python back_end/benchmarks/load_test.py --requests 300 --concurrency 16
+    python back_end/benchmarks/load_test.py --chat-latency-ms 1500 --jitter-ms 300 --json before.json
+    python back_end/benchmarks/load_test.py --url http://localhost:8000 --requests 50
+
+Questions are all distinct by default, so every request misses the caches;
+--distinct-questions N cycles through N questions instead.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import httpx
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from vectordb.numpy_store import NumpyVectorStore
+from sql.metadata import CUBE_TABLES
+from benchmarks.fake_openai import fake_embedding, DEFAULT_DIM
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+FAKE_OPENAI = os.path.join(os.path.dirname(__file__), 'fake_openai.py')
+
+INDICATORS = {
+    "pmi": "purchasing managers index",
+    "gastat_inflation_city_mom": "inflation",
+    "gastat_wpi_city_yoy": "wholesale price index",
+    "gastat_gdp_quarter": "gross domestic product",
+    "gastat_ipi_index_economic_activity": "industrial production index",
+}
+CITIES = ["Riyadh", "Jeddah", "Makkah", "Madinah", "Dammam", "Abha", "Tabuk", "Hail", "Jazan", "Najran"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+YEARS = range(2016, 2026)
+
+
+def synthetic_corpus(size, dim, seed=0):
+    """Cube-like records ('The inflation for Riyadh in March 2024 was 1.9.') with metadata and fake embeddings."""
+    rng = np.random.default_rng(seed)
+    cubes = list(INDICATORS)
+    chunks = []
+    for i in range(size):
+        cube = cubes[i % len(cubes)]
+        city, month, year = CITIES[rng.integers(len(CITIES))], MONTHS[rng.integers(12)], YEARS[rng.integers(len(YEARS))]
+        text = f"The {INDICATORS[cube]} for {city} in {month} {year} was {rng.uniform(-5, 60):.1f}."
+        chunks.append({
+            "text": text,
+            "source": f"{cube}.en.json",
+            "type": "api",
+            "language": "en",
+            "cube": cube,
+            "topic": CUBE_TABLES[cube]["topic"],
+            "year": int(year),
+            "city": city,
+            "content_hash": str(i),
+            "embedding": fake_embedding(text, dim),
+        })
+    return chunks
+
+
+def questions(count, distinct, seed=1):
+    rng = np.random.default_rng(seed)
+    pool = count if not distinct else distinct
+    made = []
+    for i in range(pool):
+        indicator = list(INDICATORS.values())[rng.integers(len(INDICATORS))]
+        city, month, year = CITIES[rng.integers(len(CITIES))], MONTHS[rng.integers(12)], YEARS[rng.integers(len(YEARS))]
+        question = f"How did the {indicator} in {city} change around {month} {year}?"
+        # Keep every question distinct when not cycling, so no request is a cache hit
+        made.append(question if distinct else f"{question} ({i})")
+    return [made[i % pool] for i in range(count)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} during startup")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def parse_server_timing(header):
+    """'embed;dur=12.3, search;dur=4.0' -> {'embed': 12.3, 'search': 4.0} (milliseconds)."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name.strip()] = float(value)
+    return timings
+
+
+async def drive(url, question_list, concurrency, timeout):
+    """Sends every question with at most `concurrency` in flight. Returns one record per request."""
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def one(question):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/api/ask", json={"question": question})
+                    status, timing = response.status_code, parse_server_timing(response.headers.get("server-timing"))
+                except httpx.HTTPError as e:
+                    status, timing = type(e).__name__, {}
+                records.append({"status": status, "latency_ms": (time.perf_counter() - start) * 1000, "stages": timing})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in question_list))
+        elapsed = time.perf_counter() - started
+    return records, elapsed
+
+
+def summarize(records, elapsed):
+    ok = [r for r in records if r["status"] == 200]
+    samples = {"client": [r["latency_ms"] for r in ok]}
+    for record in ok:
+        for stage, ms in record["stages"].items():
+            samples.setdefault(stage, []).append(ms)
+
+    def percentiles(values):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": len(values), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": {str(s): sum(1 for r in records if r["status"] == s) for s in {r["status"] for r in records} - {200}},
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency": {name: percentiles(values) for name, values in samples.items() if values},
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['ok']}/{summary['requests']} ok in {summary['elapsed_s']:.1f}s "
+          f"-> {summary['throughput_rps']:.1f} req/s")
+    if summary["errors"]:
+        print(f"errors: {summary['errors']}")
+    print(f"\n{'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in summary["latency"].items():
+        print(f"{name:<14}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def start_stand_ins(args, workdir, processes):
+    """
+    Builds the vector store and starts the fake OpenAI server and the app,
+    adding them to `processes` as they start. Returns the app's URL.
+    """
+    print(f"Embedding a synthetic corpus of {args.chunks} chunks ({args.dim} dims)...")
+    store_dir = os.path.join(workdir, "vectors")
+    NumpyVectorStore(store_dir).write(synthetic_corpus(args.chunks, args.dim))
+
+    openai_port, app_port = free_port(), free_port()
+    processes.append(subprocess.Popen([
+        sys.executable, FAKE_OPENAI, "--port", str(openai_port),
+        "--chat-latency-ms", str(args.chat_latency_ms),
+        "--embedding-latency-ms", str(args.embedding_latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate),
+        "--dim", str(args.dim),
+    ]))
+    wait_until_up(f"http://127.0.0.1:{openai_port}/docs", processes[-1])
+
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "VECTOR_BACKEND": "numpy",
+        "NUMPY_STORE_DIR": store_dir,
+        "CACHE_DB_PATH": os.path.join(workdir, "cache.sqlite3"),
+        # No cube database, so every question takes the RAG path
+        "CUBE_DB_PATH": os.path.join(workdir, "cubes.sqlite3"),
+        "LOG_PAYLOADS": "false",
+    }
+    # The app logs every request at INFO; keep it out of the report
+    app_log = open(args.app_log, "a")
+    processes.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "back_end.main:app", "--host", "127.0.0.1",
+         "--port", str(app_port), "--workers", "1", "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=app_log, stderr=subprocess.STDOUT,
+    ))
+    app_log.close()
+    url = f"http://127.0.0.1:{app_port}"
+    wait_until_up(f"{url}/health", processes[-1])
+    return url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10, help="requests sent (and ignored) before measuring")
+    parser.add_argument("--distinct-questions", type=int, default=0, help="cycle through N questions (0 = all distinct)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--url", help="benchmark an already running app instead of starting one")
+    parser.add_argument("--chunks", type=int, default=5000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--chat-latency-ms", type=float, default=800)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--app-log", default=os.devnull, help="where the started app's output goes")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            url = args.url
+            if url is None:
+                url = start_stand_ins(args, workdir, processes)
+            if args.warmup:
+                asyncio.run(drive(url, [f"Warm-up question {i}" for i in range(args.warmup)], args.concurrency, args.timeout))
+
+            print(f"Sending {args.requests} questions to {url} at concurrency {args.concurrency}...")
+            records, elapsed = asyncio.run(drive(
+                url, questions(args.requests, args.distinct_questions), args.concurrency, args.timeout
+            ))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait(timeout=10)
+
+    summary = summarize(records, elapsed)
+    summary["config"] = {k: v for k, v in vars(args).items() if k not in ("json", "app_log")}
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall vs latency vs memory of two-stage (truncated prefix + rescoring)
+search in the NumPy vector store, against exact full-width search.
+
+Runs on the store built by the pipeline (NUMPY_STORE_DIR), or on synthetic
+vectors with --synthetic. Queries are stored vectors with Gaussian noise
+added, standing in for paraphrased questions.
+
+    python back_end/benchmarks/truncated_retrieval.py
+    python back_end/benchmarks/truncated_retrieval.py --synthetic 20000 --prefix-dims 128 256 512
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from vectordb.numpy_store import NumpyVectorStore, NUMPY_STORE_DIR, normalize_rows
+
+
+def synthetic_store(directory, rows, dim, seed):
+    """Clustered vectors whose variance decays with the dimension index, like Matryoshka embeddings."""
+    rng = np.random.default_rng(seed)
+    scale = (1.0 + np.arange(dim)) ** -0.5
+    centers = rng.standard_normal((max(rows // 50, 1), dim)) * scale
+    assignments = rng.integers(0, len(centers), rows)
+    matrix = centers[assignments] + 0.5 * rng.standard_normal((rows, dim)) * scale
+    chunks = [
+        {"text": f"synthetic chunk {i}", "source": "synthetic", "content_hash": str(i), "embedding": row}
+        for i, row in enumerate(matrix.astype(np.float32))
+    ]
+    NumpyVectorStore(directory).write(chunks)
+
+
+def make_queries(matrix, count, noise, seed):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(matrix.shape[0], size=min(count, matrix.shape[0]), replace=False)
+    queries = np.asarray(matrix[picks], dtype=np.float32)
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    return normalize_rows(queries)
+
+
+def hashes(results):
+    return [r["properties"].get("content_hash") for r in results]
+
+
+def run(store, queries, top_k, truth=None):
+    latencies, found = [], []
+    store.search(queries[0], top_k)  # warm the page cache and column caches
+    for query in queries:
+        start = time.perf_counter()
+        results = store.search(query, top_k)
+        latencies.append(time.perf_counter() - start)
+        found.append(hashes(results))
+    recall = None
+    if truth is not None:
+        recall = float(np.mean([len(set(f) & set(t)) / max(len(t), 1) for f, t in zip(found, truth)]))
+    return found, recall, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 95) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store-dir", default=NUMPY_STORE_DIR)
+    parser.add_argument("--synthetic", type=int, metavar="ROWS", help="benchmark ROWS synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=3072, help="dimension of synthetic vectors")
+    parser.add_argument("--prefix-dims", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--top-k", type=int, default=7)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="query noise relative to a unit vector")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store_dir = args.store_dir
+        if args.synthetic:
+            store_dir = tmp
+            print(f"Building {args.synthetic} synthetic {args.dim}-d vectors...")
+            synthetic_store(store_dir, args.synthetic, args.dim, args.seed)
+
+        exact = NumpyVectorStore(store_dir, prefix_dims=0)
+        matrix = exact.load().matrix
+        rows, dim = matrix.shape
+        queries = make_queries(matrix, args.queries, args.noise, args.seed)
+        truth, _, p50, p95 = run(exact, queries, args.top_k)
+        full_mb = matrix.nbytes / 2**20
+
+        print(f"\n{rows} vectors x {dim} dims, {len(queries)} queries, recall@{args.top_k}\n")
+        print(f"| {'mode':<20} | {'recall':>6} | {'p50 ms':>7} | {'p95 ms':>7} | {'RAM index MB':>12} | {'rescored MB/query':>17} |")
+        print(f"|{'-' * 22}|{'-' * 8}|{'-' * 9}|{'-' * 9}|{'-' * 14}|{'-' * 19}|")
+        print(f"| {'exact (full width)':<20} | {1.0:>6.3f} | {p50:>7.2f} | {p95:>7.2f} | {full_mb:>12.1f} | {full_mb:>17.2f} |")
+
+        for prefix_dims in args.prefix_dims:
+            if prefix_dims >= dim:
+                continue
+            for factor in args.rescore_factors:
+                store = NumpyVectorStore(store_dir, prefix_dims=prefix_dims, rescore_factor=factor)
+                prefix = store.load().prefix
+                _, recall, p50, p95 = run(store, queries, args.top_k, truth)
+                index_mb = prefix.nbytes / 2**20
+                rescored_mb = min(args.top_k * factor, rows) * dim * 4 / 2**20
+                mode = f"{prefix_dims}-d x{factor}"
+                print(f"| {mode:<20} | {recall:>6.3f} | {p50:>7.2f} | {p95:>7.2f} | {index_mb:>12.1f} | {rescored_mb:>17.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# embedding/cache.py
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+import aiosqlite
+import numpy as np
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(DATA_DIR, 'cache.sqlite3'))
+EMBEDDING_CACHE_MAX_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MAX_MEMORY_ITEMS", 2048))
+EMBEDDING_CACHE_MAX_DISK_ITEMS = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_ITEMS", 100_000))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 30 * 24 * 3600))
+# Prune the SQLite tier once every N writes rather than on every insert
+PRUNE_EVERY = 500
+
+
+def normalize_text(text):
+    """Normalizes a query so trivially different spellings share a cache entry."""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).casefold()
+
+
+def pack_vector(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+class EmbeddingCache:
+    """Two-tier cache of query embeddings keyed on (model, normalized text).
+
+    The first tier is an in-process LRU. The second is a SQLite table shared by
+    every uvicorn worker on the host, storing vectors as packed float32 blobs.
+    Both tiers honour the same TTL. Cache failures are logged and treated as
+    misses so they never break a request.
+    """
+
+    def __init__(
+        self,
+        db_path=CACHE_DB_PATH,
+        max_memory_items=EMBEDDING_CACHE_MAX_MEMORY_ITEMS,
+        max_disk_items=EMBEDDING_CACHE_MAX_DISK_ITEMS,
+        ttl=EMBEDDING_CACHE_TTL,
+    ):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._db = None
+        self._db_lock = asyncio.Lock()
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, text):
+        digest = hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    async def _get_db(self):
+        if self._db is None:
+            async with self._db_lock:
+                if self._db is None:
+                    os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                    db = await aiosqlite.connect(self.db_path, timeout=5)
+                    # WAL lets several workers read while one writes
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.execute(
+                        "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                        " key TEXT PRIMARY KEY,"
+                        " model TEXT NOT NULL,"
+                        " vector BLOB NOT NULL,"
+                        " created_at REAL NOT NULL,"
+                        " last_access REAL NOT NULL)"
+                    )
+                    await db.execute(
+                        "CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access "
+                        "ON embedding_cache(last_access)"
+                    )
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def open(self):
+        """Opens the SQLite tier ahead of the first lookup."""
+        await self._get_db()
+
+    def _remember(self, key, vector, created_at):
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    async def get(self, model, text):
+        """Returns the cached embedding as a list of floats, or None on a miss."""
+        key = self.make_key(model, text)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            vector, created_at = entry
+            if now - created_at < self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                CACHE_REQUESTS.labels("embedding", "memory_hit").inc()
+                return vector.tolist()
+            del self._memory[key]
+
+        try:
+            db = await self._get_db()
+            async with db.execute(
+                "SELECT vector, created_at FROM embedding_cache WHERE key = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                await db.execute(
+                    "UPDATE embedding_cache SET last_access = ? WHERE key = ?", (now, key)
+                )
+                await db.commit()
+                vector = unpack_vector(row[0])
+                self._remember(key, vector, row[1])
+                self.disk_hits += 1
+                CACHE_REQUESTS.labels("embedding", "disk_hit").inc()
+                return vector.tolist()
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+
+        self.misses += 1
+        CACHE_REQUESTS.labels("embedding", "miss").inc()
+        return None
+
+    async def set(self, model, text, vector):
+        key = self.make_key(model, text)
+        now = time.time()
+        self._remember(key, np.asarray(vector, dtype=np.float32), now)
+        try:
+            db = await self._get_db()
+            await db.execute(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, vector, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, pack_vector(vector), now, now),
+            )
+            await db.commit()
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= PRUNE_EVERY:
+                self._writes_since_prune = 0
+                await self.prune()
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    async def prune(self):
+        """Drops expired rows, then the least recently used rows above the size limit."""
+        db = await self._get_db()
+        await db.execute(
+            "DELETE FROM embedding_cache WHERE created_at < ?", (time.time() - self.ttl,)
+        )
+        await db.execute(
+            "DELETE FROM embedding_cache WHERE key IN ("
+            " SELECT key FROM embedding_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_items,),
+        )
+        await db.commit()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+embedding_cache = EmbeddingCache()
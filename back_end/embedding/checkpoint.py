@@ -0,0 +1,160 @@
+# embedding/checkpoint.py
+
+import os
+import json
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+EMBEDDED_DIR = os.getenv("EMBEDDING_CHECKPOINT_DIR", os.path.join(DATA_DIR, 'embedded'))
+VECTORS_FILE = 'vectors.f32'
+CHUNKS_FILE = 'chunks.jsonl'
+META_FILE = 'meta.json'
+
+
+class EmbeddingCheckpoint:
+    """Append-only on-disk record of embedded chunks.
+
+    Vectors are appended as raw float32 rows to vectors.f32, which is read
+    back with np.memmap, and chunk properties go to a JSONL sidecar with one
+    line per row. Each append fsyncs the vectors before the sidecar, so a
+    sidecar line only exists once its vector is on disk. open() trims
+    whatever a crash left half-written, and the next run skips every chunk
+    that is already here.
+
+    meta.json records the model and dimension; a checkpoint written by a
+    different model is discarded.
+    """
+
+    def __init__(self, directory=EMBEDDED_DIR, model=None):
+        self.directory = directory
+        self.model = model
+        self.vectors_path = os.path.join(directory, VECTORS_FILE)
+        self.chunks_path = os.path.join(directory, CHUNKS_FILE)
+        self.meta_path = os.path.join(directory, META_FILE)
+        self.dim = None
+        self._rows = []
+        self._index = {}
+        self._mapped = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, content_hash):
+        return content_hash in self._index
+
+    # --- Reading ---
+
+    def open(self):
+        """Loads an existing checkpoint, trimming a torn tail. Returns the number of rows."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._rows, self._index, self._mapped = [], {}, None
+        self.dim = None
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if self.model and meta.get("model") != self.model:
+                logger.warning(f"Discarding embeddings checkpoint made with {meta.get('model')}")
+                self.clear()
+                return 0
+            self.dim = meta["dim"]
+
+        if self.dim is None or not os.path.exists(self.chunks_path):
+            self.clear()
+            return 0
+
+        row_bytes = self.dim * 4
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        valid_bytes = 0
+        with open(self.chunks_path, 'rb') as f:
+            for line in f:
+                if len(self._rows) == vector_rows or not line.endswith(b"\n"):
+                    break
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    break
+                self._index[row.get("content_hash")] = len(self._rows)
+                self._rows.append(row)
+                valid_bytes += len(line)
+
+        # Drop anything past the last complete row
+        with open(self.chunks_path, 'r+b') as f:
+            f.truncate(valid_bytes)
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(len(self._rows) * row_bytes)
+
+        if self._rows:
+            logger.info(f"Loaded {len(self._rows)} checkpointed embeddings from {self.directory}")
+        return len(self._rows)
+
+    def _vectors(self):
+        """Memory-mapped view of every complete row."""
+        if self._mapped is None or self._mapped.shape[0] != len(self._rows):
+            if not self._rows:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            self._mapped = np.memmap(
+                self.vectors_path, dtype=np.float32, mode='r', shape=(len(self._rows), self.dim)
+            )
+        return self._mapped
+
+    def vector(self, content_hash):
+        """The stored embedding for a content hash, as a read-only view."""
+        return self._vectors()[self._index[content_hash]]
+
+    def iter_batches(self, batch_size=200):
+        """Yields lists of chunk dicts whose 'embedding' is a view into the mapped file."""
+        vectors = self._vectors()
+        for start in range(0, len(self._rows), batch_size):
+            stop = min(start + batch_size, len(self._rows))
+            yield [
+                {**self._rows[i], "embedding": vectors[i]}
+                for i in range(start, stop)
+            ]
+
+    # --- Writing ---
+
+    def append(self, chunks):
+        """Durably appends embedded chunks. Safe to call from several threads."""
+        rows = [chunk for chunk in chunks if chunk.get("embedding") is not None]
+        if not rows:
+            return
+        matrix = np.asarray([chunk["embedding"] for chunk in rows], dtype=np.float32)
+        properties = [{k: v for k, v in chunk.items() if k != "embedding"} for chunk in rows]
+        lines = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in properties)
+
+        with self._lock:
+            if self.dim is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self.dim = matrix.shape[1]
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dim embeddings, got {matrix.shape[1]}")
+
+            with open(self.vectors_path, 'ab') as f:
+                f.write(matrix.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.chunks_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+            for row in properties:
+                self._index[row.get("content_hash")] = len(self._rows)
+                self._rows.append(row)
+
+    def clear(self):
+        """Removes the checkpoint, e.g. once its chunks are safely in the vector store."""
+        for path in (self.vectors_path, self.chunks_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._rows, self._index, self._mapped = [], {}, None
+        self.dim = None
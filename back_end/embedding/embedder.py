@@ -1,49 +1,62 @@
 # embedding/embedder.py
 
-import openai
 import json
 import asyncio
 import logging
-import os
-from dotenv import load_dotenv
+from llm.llm_client import LLMClient
+from embedding.scheduler import EmbeddingScheduler, MAX_IN_FLIGHT
+from embedding.checkpoint import EmbeddingCheckpoint, EMBEDDED_DIR
 
-# Load .env file from the project root
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
-load_dotenv(dotenv_path=dotenv_path)
+logger = logging.getLogger(__name__)
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = "text-embedding-3-large"
 
-async def embed_chunks_async(chunks_file, embedded_file, batch_size=256, delay_between_batches=0.6):
-    logger = logging.getLogger(__name__)
-    loop = asyncio.get_event_loop()
+def create_pipeline_client():
+    # The pipeline gets its own client so it never competes with the API's pool.
+    # Retries are left to the scheduler, which knows about the rate limits.
+    return LLMClient(embedding_concurrency=MAX_IN_FLIGHT, embedding_timeout=120, max_retries=0)
+
+async def embed_chunks_async(chunks_file, embedded_dir=EMBEDDED_DIR, model=EMBEDDING_MODEL):
+    """
+    Embeds the chunks in a JSON file into an EmbeddingCheckpoint at
+    embedded_dir. Chunks already in the checkpoint are skipped, so rerunning
+    after a crash resumes where it stopped.
+    """
     with open(chunks_file, encoding='utf-8') as f:
         chunks = json.load(f)
-    embedded_chunks = []
-    texts_batch = []
-    metas_batch = []
-
-    async def batch_embed_texts(texts, model="text-embedding-3-large"):
-        for _ in range(3):
-            try:
-                response = await loop.run_in_executor(None, lambda: openai.embeddings.create(model=model, input=texts))
-                return [emb.embedding for emb in response.data]
-            except Exception as e:
-                logger.warning(f"Batch embedding error, retrying: {e}")
-                await asyncio.sleep(2)
-        return [None for _ in texts]
-
-    for i, chunk in enumerate(chunks):
-        texts_batch.append(chunk["text"])
-        metas_batch.append(chunk)
-        if len(texts_batch) == batch_size or i == len(chunks) - 1:
-            embeddings = await batch_embed_texts(texts_batch)
-            for meta, emb in zip(metas_batch, embeddings):
-                meta["embedding"] = emb
-                embedded_chunks.append(meta)
-            logger.info(f"Embedded {len(embedded_chunks)}/{len(chunks)}")
-            texts_batch, metas_batch = [], []
-            await asyncio.sleep(delay_between_batches)
-
-    with open(embedded_file, "w", encoding="utf-8") as f:
-        json.dump(embedded_chunks, f, ensure_ascii=False, indent=2)
-    logger.info(f"Saved all embedded chunks to {embedded_file}")
+
+    checkpoint = EmbeddingCheckpoint(embedded_dir, model)
+    checkpoint.open()
+    in_queue, out_queue = asyncio.Queue(), asyncio.Queue(maxsize=MAX_IN_FLIGHT)
+    for chunk in chunks:
+        if chunk["content_hash"] not in checkpoint:
+            in_queue.put_nowait(chunk)
+    in_queue.put_nowait(None)
+
+    async def discard_embedded():
+        # The checkpoint already holds every embedded chunk; nothing else needs them
+        while await out_queue.get() is not None:
+            pass
+
+    async with asyncio.TaskGroup() as tasks:
+        tasks.create_task(discard_embedded())
+        tasks.create_task(embed_chunk_stream(in_queue, out_queue, model, checkpoint))
+    logger.info(f"{len(checkpoint)} embedded chunks saved to {embedded_dir}")
+
+async def embed_chunk_stream(in_queue, out_queue, model=EMBEDDING_MODEL, checkpoint=None, progress=None):
+    """
+    Streaming counterpart of embed_chunks_async: reads chunks from in_queue
+    until a None sentinel, embeds them through an EmbeddingScheduler and puts
+    each embedded chunk on out_queue, followed by None. Each batch is also
+    appended to `checkpoint` when one is given, and counted in `progress`.
+
+    Returns the scheduler's throughput stats.
+    """
+    client = create_pipeline_client()
+    try:
+        scheduler = EmbeddingScheduler(client, model, checkpoint=checkpoint, progress=progress)
+        stats = await scheduler.run(in_queue, out_queue)
+    finally:
+        await client.aclose()
+    await out_queue.put(None)
+    return stats
@@ -0,0 +1,316 @@
+# embedding/scheduler.py
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import openai
+from llm.llm_client import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 100_000))
+BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", 2048))
+MAX_IN_FLIGHT = int(os.getenv("EMBEDDING_MAX_IN_FLIGHT", 8))
+MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", 6))
+REPORT_INTERVAL = float(os.getenv("EMBEDDING_REPORT_INTERVAL", 10))
+# Error statuses worth another attempt, besides 5xx
+RETRYABLE_STATUSES = (408, 429)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Parses rate-limit durations such as '20ms', '1s', '6m0s' or '2.5' into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(headers):
+    retry_after_ms = _header_int(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+def _backoff(attempt):
+    return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+
+class _Batch:
+    __slots__ = ("chunks", "tokens", "attempts")
+
+    def __init__(self, chunks, tokens, attempts=0):
+        self.chunks = chunks
+        self.tokens = tokens
+        self.attempts = attempts
+
+
+class EmbeddingScheduler:
+    """Embeds a stream of chunks with several token-packed batches in flight.
+
+    Batches are packed up to `max_batch_tokens` estimated tokens (and at most
+    `max_batch_items` inputs). The number of requests in flight adapts
+    AIMD-style: it grows by one after a window of clean responses, halves on a
+    429, and every sender pauses until `Retry-After` has passed. The
+    x-ratelimit-remaining-* headers are watched so that sending stops until the
+    reset time once the remaining budget cannot cover the batches in flight.
+
+    Failed batches are put back on the queue with a backoff. A batch the API
+    rejects as invalid is split in halves to isolate the offending input, and
+    only a chunk that fails on its own or exhausts `max_attempts` is dropped
+    (and counted). Dropped chunks are not uploaded, so the next refresh picks
+    them up again.
+
+    With a `checkpoint`, every successful batch is appended to it before it is
+    passed on, so an interrupted run loses at most the batches in flight.
+    With a `progress` dict, its "chunks_embedded" count is kept current.
+    """
+
+    def __init__(
+        self,
+        client,
+        model,
+        max_batch_tokens=BATCH_MAX_TOKENS,
+        max_batch_items=BATCH_MAX_ITEMS,
+        max_in_flight=MAX_IN_FLIGHT,
+        max_attempts=MAX_ATTEMPTS,
+        linger=1.0,
+        report_interval=REPORT_INTERVAL,
+        checkpoint=None,
+        progress=None,
+    ):
+        self.client = client
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.linger = linger
+        self.report_interval = report_interval
+        self.checkpoint = checkpoint
+        self.progress = progress
+
+        # Start at half speed and let clean responses ramp it up
+        self.limit = max(1, max_in_flight // 2)
+        self._in_flight = 0
+        self._clean_responses = 0
+        self._resume_at = 0.0
+        self._slots = asyncio.Condition()
+        self._batches = asyncio.Queue()
+        self._queue_space = asyncio.Condition()
+
+        self.embedded = 0
+        self.tokens = 0
+        self.retries = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self._started = None
+
+    # --- Flow control ---
+
+    async def _acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        while (delay := self._resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def _release(self):
+        async with self._slots:
+            self._in_flight -= 1
+            self._slots.notify_all()
+
+    def _pause(self, seconds):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def _on_success(self, headers, batch):
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining_requests is not None and remaining_requests < self.limit:
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+            if reset:
+                self._pause(reset)
+        if remaining_tokens is not None and remaining_tokens < self.limit * batch.tokens:
+            reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            if reset:
+                self._pause(reset)
+
+        self._clean_responses += 1
+        if self._clean_responses >= self.limit and self.limit < self.max_in_flight:
+            self.limit += 1
+            self._clean_responses = 0
+
+    def _on_rate_limited(self, headers, batch):
+        self.rate_limited += 1
+        self.limit = max(1, self.limit // 2)
+        self._clean_responses = 0
+        delay = _retry_after(headers)
+        self._pause(delay if delay is not None else _backoff(batch.attempts))
+        logger.warning(f"Embedding rate limited; {self.limit} requests in flight from now on")
+
+    # --- Stages ---
+
+    async def _pack(self, in_queue):
+        """Reads chunks until the None sentinel and packs them into batches by token count."""
+        carry = None
+        finished = False
+        while not finished:
+            chunk = carry if carry is not None else await in_queue.get()
+            carry = None
+            if chunk is None:
+                break
+            batch, tokens = [chunk], estimate_tokens(chunk["text"])
+            while len(batch) < self.max_batch_items:
+                try:
+                    chunk = await asyncio.wait_for(in_queue.get(), timeout=self.linger)
+                except asyncio.TimeoutError:
+                    break
+                if chunk is None:
+                    finished = True
+                    break
+                chunk_tokens = estimate_tokens(chunk["text"])
+                if tokens + chunk_tokens > self.max_batch_tokens:
+                    carry = chunk
+                    break
+                batch.append(chunk)
+                tokens += chunk_tokens
+
+            # Keep at most max_in_flight batches waiting so back-pressure reaches the producer
+            async with self._queue_space:
+                await self._queue_space.wait_for(lambda: self._batches.qsize() < self.max_in_flight)
+            self._batches.put_nowait(_Batch(batch, tokens))
+
+    async def _worker(self, out_queue):
+        while True:
+            batch = await self._batches.get()
+            async with self._queue_space:
+                self._queue_space.notify()
+            try:
+                await self._send(batch, out_queue)
+            finally:
+                self._batches.task_done()
+
+    async def _send(self, batch, out_queue):
+        texts = [chunk["text"] for chunk in batch.chunks]
+        retry_delay = None
+        await self._acquire()
+        try:
+            embeddings, headers = await self.client.embed_with_headers(texts, self.model)
+        except openai.RateLimitError as e:
+            self._on_rate_limited(e.response.headers, batch)
+            retry_delay = 0
+        except openai.BadRequestError as e:
+            if len(batch.chunks) == 1:
+                self.failed += 1
+                logger.error(f"Embedding rejected for chunk from {batch.chunks[0].get('source')}: {e}")
+                return
+            self._split(batch)
+            return
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            logger.warning(f"Embedding batch of {len(texts)} failed, re-queueing: {e!r}")
+            retry_delay = _backoff(batch.attempts)
+        except openai.APIError as e:
+            # Anything else from the API: timeouts, 408, 429 and 5xx may pass next time, other statuses won't
+            status = e.status_code if isinstance(e, openai.APIStatusError) else None
+            if status is not None and status < 500 and status not in RETRYABLE_STATUSES:
+                self.failed += len(batch.chunks)
+                logger.error(f"Embedding batch of {len(texts)} failed with status {status}, giving up: {e!r}")
+                return
+            logger.warning(f"Embedding batch of {len(texts)} failed, re-queueing: {e!r}")
+            retry_delay = _backoff(batch.attempts)
+        else:
+            self._on_success(headers, batch)
+        finally:
+            await self._release()
+
+        if retry_delay is not None:
+            await self._retry(batch, retry_delay)
+            return
+
+        for chunk, embedding in zip(batch.chunks, embeddings):
+            chunk["embedding"] = embedding
+        if self.checkpoint is not None:
+            await asyncio.to_thread(self.checkpoint.append, batch.chunks)
+        for chunk in batch.chunks:
+            await out_queue.put(chunk)
+        self.embedded += len(batch.chunks)
+        if self.progress is not None:
+            self.progress["chunks_embedded"] = self.embedded
+        self.tokens += batch.tokens
+
+    async def _retry(self, batch, delay):
+        batch.attempts += 1
+        if batch.attempts >= self.max_attempts:
+            self.failed += len(batch.chunks)
+            logger.error(f"Giving up on {len(batch.chunks)} chunks after {batch.attempts} attempts")
+            return
+        self.retries += 1
+        await asyncio.sleep(delay)
+        self._batches.put_nowait(batch)
+
+    def _split(self, batch):
+        middle = len(batch.chunks) // 2
+        for half in (batch.chunks[:middle], batch.chunks[middle:]):
+            tokens = sum(estimate_tokens(chunk["text"]) for chunk in half)
+            self._batches.put_nowait(_Batch(half, tokens, batch.attempts))
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.log_throughput()
+
+    # --- Public API ---
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        return {
+            "chunks": self.embedded,
+            "tokens": self.tokens,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.embedded / elapsed, 2) if elapsed else 0.0,
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def log_throughput(self):
+        stats = self.stats()
+        logger.info(
+            f"Embedded {stats['chunks']} chunks in {stats['seconds']}s "
+            f"({stats['chunks_per_second']} chunks/s, ~{stats['tokens_per_second']} tokens/s, "
+            f"{self.limit} in flight, {stats['retries']} retries, {stats['failed']} failed)"
+        )
+
+    async def run(self, in_queue, out_queue):
+        """Embeds chunks from in_queue (until a None sentinel) onto out_queue; returns stats()."""
+        self._started = time.monotonic()
+        async with asyncio.TaskGroup() as tasks:
+            workers = [tasks.create_task(self._worker(out_queue)) for _ in range(self.max_in_flight)]
+            reporter = tasks.create_task(self._report())
+            await self._pack(in_queue)
+            await self._batches.join()
+            for task in [*workers, reporter]:
+                task.cancel()
+        self.log_throughput()
+        return self.stats()
@@ -0,0 +1,229 @@
+"""
+Background runner for data refreshes.
+
+A refresh runs pipeline.main in a separate process, so its CPU work and the
+blocking calls inside it never touch the API's event loop. The process
+sends a snapshot of its progress every PIPELINE_PROGRESS_INTERVAL seconds;
+a thread in the API process keeps the job's status current from them.
+
+Only one refresh runs at a time: the runner refuses to start a second job,
+and the job process holds an exclusive lock on PIPELINE_LOCK_PATH, which
+also keeps a refresh started from the command line from overlapping one
+started through the API.
+
+Cancelling asks the process to cancel the pipeline task, which stops the
+stages cleanly (embeddings done so far stay checkpointed for the next run).
+A process that has not exited PIPELINE_CANCEL_GRACE seconds later is
+terminated.
+"""
+import os
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process check applies
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
+PIPELINE_LOCK_PATH = os.getenv("PIPELINE_LOCK_PATH", os.path.join(DATA_DIR, 'pipeline.lock'))
+PIPELINE_PROGRESS_INTERVAL = float(os.getenv("PIPELINE_PROGRESS_INTERVAL", 1.0))
+PIPELINE_CANCEL_GRACE = float(os.getenv("PIPELINE_CANCEL_GRACE", 30))
+# Finished jobs kept for the status endpoints
+JOB_HISTORY = 20
+
+ACTIVE_STATUSES = ("starting", "running", "cancelling")
+
+
+class PipelineBusy(Exception):
+    """A refresh is already running."""
+
+
+@contextmanager
+def single_run_lock(path=PIPELINE_LOCK_PATH):
+    """Holds the cross-process refresh lock, or raises PipelineBusy if another process has it."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise PipelineBusy(f"Another refresh holds {path}") from None
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# --- Job process ---
+
+async def _run_with_progress(updates, cancel):
+    from pipeline import main as run_pipeline
+
+    progress = {}
+    task = asyncio.create_task(run_pipeline(progress))
+    while not task.done():
+        updates.put(("progress", dict(progress)))
+        if cancel.is_set():
+            task.cancel()
+        await asyncio.wait({task}, timeout=PIPELINE_PROGRESS_INTERVAL)
+    updates.put(("progress", dict(progress)))
+    return task.result()
+
+
+def _job_process(updates, cancel):
+    """Entry point of the refresh process. Ends by sending exactly one final status."""
+    logging.basicConfig(level=logging.INFO)
+    try:
+        with single_run_lock():
+            report = asyncio.run(_run_with_progress(updates, cancel))
+    except asyncio.CancelledError:
+        updates.put(("cancelled", None))
+    except BaseException as e:
+        logger.exception("Refresh failed")
+        updates.put(("failed", f"{type(e).__name__}: {e}"))
+    else:
+        updates.put(("succeeded", report))
+
+
+# --- API side ---
+
+class PipelineJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "starting"
+        self.progress = {}
+        self.report = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._process = None
+        self._cancel = None
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "report": self.report,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 1),
+        }
+
+
+class JobRunner:
+    """Starts refresh processes and tracks their status. Safe to call from the event loop."""
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+
+    def start(self):
+        """Starts a refresh and returns its job, or raises PipelineBusy."""
+        with self._lock:
+            running = next((job for job in self._jobs.values() if job.active), None)
+            if running is not None:
+                raise PipelineBusy(f"Refresh {running.id} is still {running.status}")
+            job = PipelineJob()
+            updates = self._context.Queue()
+            job._cancel = self._context.Event()
+            job._process = self._context.Process(
+                target=_job_process, args=(updates, job._cancel), name=f"pipeline-{job.id}"
+            )
+            job._process.start()
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.active:
+                    break
+                self._jobs.popitem(last=False)
+        threading.Thread(target=self._follow, args=(job, updates), name=f"follow-{job.id}", daemon=True).start()
+        logger.info(f"Started refresh {job.id} (pid {job._process.pid})")
+        return job
+
+    def _follow(self, job, updates):
+        """Applies the job process's messages to the job until it finishes."""
+        while True:
+            try:
+                kind, payload = updates.get(timeout=1)
+            except queue.Empty:
+                if job._process.is_alive():
+                    continue
+                # Killed or crashed without a final status
+                self._finish(job, "cancelled" if job.status == "cancelling" else "failed",
+                             error=f"Refresh process exited with code {job._process.exitcode}")
+                break
+            if kind == "progress":
+                job.progress = payload
+                if job.status == "starting":
+                    job.status = "running"
+            elif kind == "succeeded":
+                # Some sources could not be read: the stores hold stale data for them
+                failed = payload.get("api_fetch", {}).get("failed", 0)
+                self._finish(job, "degraded" if failed else kind, report=payload,
+                             error=f"{failed} API files could not be fetched" if failed else None)
+                break
+            else:
+                self._finish(job, kind, error=payload)
+                break
+        job._process.join()
+
+    @staticmethod
+    def _finish(job, status, report=None, error=None):
+        job.status, job.report, job.error = status, report, error
+        job.finished_at = time.time()
+        logger.info(f"Refresh {job.id} {status}" + (f": {error}" if error else ""))
+
+    def cancel(self, job_id):
+        """Asks a running job to stop. Returns the job, or None if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is None or not job.active:
+            return job
+        job.status = "cancelling"
+        job._cancel.set()
+
+        def terminate_if_stuck():
+            job._process.join(PIPELINE_CANCEL_GRACE)
+            if job._process.is_alive():
+                logger.warning(f"Refresh {job.id} did not stop within {PIPELINE_CANCEL_GRACE}s, terminating")
+                job._process.terminate()
+
+        threading.Thread(target=terminate_if_stuck, daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def shutdown(self):
+        """Cancels the running job, if any, and waits for its process to exit."""
+        for job in list(self._jobs.values()):
+            if job.active:
+                self.cancel(job.id)
+                job._process.join(PIPELINE_CANCEL_GRACE)
+                if job._process.is_alive():
+                    job._process.terminate()
+
+
+job_runner = JobRunner()
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import logging
+import httpx
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from metrics import UPSTREAM_RETRIES, record_usage
+
+# Load .env file from the project root
+dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 200))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 50))
+CHAT_CONCURRENCY = int(os.getenv("OPENAI_CHAT_CONCURRENCY", 64))
+EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDING_CONCURRENCY", 32))
+CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", 60))
+EMBEDDING_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT", 20))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+
+
+def chat_completion_kwargs(messages, model, max_tokens, temperature):
+    """Builds Chat Completions arguments, accounting for GPT-5 parameter differences."""
+    # Use max_completion_tokens for GPT-5 variants, max_tokens for other models
+    token_param = "max_completion_tokens" if "gpt-5" in model else "max_tokens"
+    kwargs = {
+        "model": model,
+        "messages": messages,
+        token_param: max_tokens,
+    }
+
+    # Only add temperature parameter for non-GPT-5 models
+    if "gpt-5" not in model and temperature is not None:
+        kwargs["temperature"] = temperature
+    return kwargs
+
+
+def estimate_tokens(text):
+    """Cheap upper-bound token estimate (~4 UTF-8 bytes per token).
+
+    Counting bytes rather than characters keeps Arabic text, which tokenizes
+    more densely than English, from being underestimated.
+    """
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+async def _count_retryable_response(response):
+    # The SDK retries 429 and 5xx responses itself; count them as they arrive
+    if response.status_code == 429 or response.status_code >= 500:
+        UPSTREAM_RETRIES.labels("openai").inc()
+
+
+class LLMClient:
+    """Native async OpenAI client shared by every chat and embedding call.
+
+    All requests go through one httpx connection pool. Chat and embedding
+    calls are limited by separate semaphores so a burst of one kind cannot
+    starve the other, and every call has its own timeout. Cancelling the
+    awaiting task cancels the underlying HTTP request.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        chat_concurrency=CHAT_CONCURRENCY,
+        embedding_concurrency=EMBEDDING_CONCURRENCY,
+        chat_timeout=CHAT_TIMEOUT,
+        embedding_timeout=EMBEDDING_TIMEOUT,
+        max_retries=MAX_RETRIES,
+    ):
+        self.chat_timeout = chat_timeout
+        self.embedding_timeout = embedding_timeout
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(chat_timeout, connect=CONNECT_TIMEOUT),
+            event_hooks={"response": [_count_retryable_response]},
+        )
+        self.openai = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            http_client=self._http_client,
+            max_retries=max_retries,
+        )
+        self._chat_semaphore = asyncio.Semaphore(chat_concurrency)
+        self._embedding_semaphore = asyncio.Semaphore(embedding_concurrency)
+
+    async def chat(self, messages, model, max_tokens, temperature=None, timeout=None):
+        """Returns the stripped content of a single chat completion."""
+        kwargs = chat_completion_kwargs(messages, model, max_tokens, temperature)
+        async with self._chat_semaphore:
+            response = await self.openai.chat.completions.create(
+                **kwargs, timeout=timeout or self.chat_timeout
+            )
+        record_usage(model, response.usage)
+        return response.choices[0].message.content.strip()
+
+    async def stream_chat(self, messages, model, max_tokens, temperature=None, timeout=None):
+        """Yields content deltas of a streamed chat completion as they arrive.
+
+        The upstream response is closed when the consumer stops iterating,
+        including when the awaiting task is cancelled.
+        """
+        kwargs = chat_completion_kwargs(messages, model, max_tokens, temperature)
+        async with self._chat_semaphore:
+            stream = await self.openai.chat.completions.create(
+                **kwargs, stream=True, stream_options={"include_usage": True},
+                timeout=timeout or self.chat_timeout,
+            )
+            try:
+                async for chunk in stream:
+                    # The last chunk carries the usage and no choices
+                    record_usage(model, getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+    async def embed(self, texts, model, timeout=None):
+        """Returns one embedding per input text, in input order."""
+        async with self._embedding_semaphore:
+            response = await self.openai.embeddings.create(
+                model=model, input=texts, timeout=timeout or self.embedding_timeout
+            )
+        record_usage(model, response.usage)
+        return [item.embedding for item in response.data]
+
+    async def embed_with_headers(self, texts, model, timeout=None):
+        """Like embed(), but also returns the HTTP response headers (rate-limit state)."""
+        async with self._embedding_semaphore:
+            raw = await self.openai.embeddings.with_raw_response.create(
+                model=model, input=texts, timeout=timeout or self.embedding_timeout
+            )
+        response = raw.parse()
+        record_usage(model, response.usage)
+        return [item.embedding for item in response.data], raw.headers
+
+    async def aclose(self):
+        await self.openai.close()
+        await self._http_client.aclose()
+
+
+_llm_client = None
+
+
+def get_llm_client():
+    """Returns the process-wide LLMClient used by the query path."""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    return _llm_client
+
+
+async def close_llm_client():
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+        logger.info("Closed shared OpenAI client")
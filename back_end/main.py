@@ -1,17 +1,91 @@
 import os
+import sys
 import uvicorn
 import logging
+import json
+import time
+import uuid
+import importlib
+from contextlib import asynccontextmanager, aclosing
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 
+# Make back_end modules importable the same way the agents and pipeline import them
+sys.path.append(os.path.dirname(__file__))
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Lifespan ---
+async def warm_up(app: FastAPI):
+    """
+    Imports and initialises the answer agent, connects to the vector store
+    and primes the caches, then marks the app ready (see /ready). Runs in the
+    background so /health answers while the worker warms up.
+    """
+    started = time.perf_counter()
+    try:
+        # Loads .env, the prompts and the OpenAI SDK; kept off the event loop
+        answer_agent = await asyncio.to_thread(importlib.import_module, "back_end.agents.answer_agent")
+    except ImportError as e:
+        app.state.warmup_error = f"Agent import failed: {e}"
+        logger.error(app.state.warmup_error)
+        return
+
+    try:
+        from vectordb import get_vector_store
+        await get_vector_store().connect()
+    except Exception as e:
+        # Searches will retry the connection lazily
+        logger.error(f"Could not connect to the vector store on startup: {e}")
+
+    try:
+        await answer_agent.warm_up()
+    except Exception as e:
+        logger.error(f"Cache warm-up failed: {e}")
+
+    app.state.warmup_seconds = time.perf_counter() - started
+    app.state.ready = True
+    logger.info(f"Warm-up finished in {app.state.warmup_seconds:.1f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up in the background on startup and close upstream connections on shutdown."""
+    app.state.ready = False
+    app.state.warmup_error = None
+    app.state.warmup_seconds = None
+    warmup = asyncio.create_task(warm_up(app))
+
+    yield
+
+    warmup.cancel()
+    try:
+        await warmup
+    except asyncio.CancelledError:
+        pass
+    if "jobs" in sys.modules:
+        # A refresh interrupted here resumes from its embedding checkpoint next time
+        await asyncio.to_thread(sys.modules["jobs"].job_runner.shutdown)
+    try:
+        from vectordb import get_vector_store
+        await get_vector_store().close()
+    except Exception as e:
+        logger.error(f"Could not close the vector store: {e}")
+    try:
+        from llm.llm_client import close_llm_client
+        from embedding.cache import embedding_cache
+        from back_end.agents.answer_agent import answer_cache
+        await close_llm_client()
+        await embedding_cache.close()
+        await answer_cache.close()
+    except ImportError as e:
+        logger.error(f"LLM client import failed: {e}")
+
 # --- FastAPI App ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -22,6 +96,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Reports the request's stage timings (see metrics.stage_timer) in a Server-Timing header.
+
+    Also tags the request with an id, returned in X-Request-ID, that its log lines can quote.
+    """
+    request.state.request_id = uuid.uuid4().hex[:12]
+    try:
+        from metrics import begin_request_timings
+    except ImportError:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request.state.request_id
+        return response
+    timings = begin_request_timings(request.state.request_id)
+    started = time.perf_counter()
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request.state.request_id
+    # A streamed answer's headers go out before its stages have run
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        return response
+    timings["total"] = time.perf_counter() - started
+    response.headers["Server-Timing"] = ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+    return response
+
 # --- API Endpoints ---
 @app.get("/")
 async def health_check():
@@ -33,49 +133,136 @@ async def health():
     """Alternative health check endpoint."""
     return {"status": "healthy", "service": "datasaudi-chatbot"}
 
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness: 200 once the agent is loaded and the caches are warm, 503 until then."""
+    state = request.app.state
+    if state.ready:
+        return {"status": "ready", "warmup_seconds": round(state.warmup_seconds, 2)}
+    if state.warmup_error:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": state.warmup_error})
+    return JSONResponse(status_code=503, content={"status": "starting"})
+
 @app.get("/test")
 async def test():
     """Simple test endpoint."""
     return {"message": "Test endpoint working", "timestamp": "2025-09-15"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the query caches of this worker."""
+    try:
+        from embedding.cache import embedding_cache
+        from back_end.agents.answer_agent import answer_cache, cube_store
+        return {
+            "embedding": embedding_cache.stats(),
+            "answer": answer_cache.stats(),
+            "sql_fast_path": cube_store.stats(),
+        }
+    except ImportError as e:
+        return JSONResponse(status_code=503, content={"error": f"Cache unavailable: {str(e)}"})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics for this worker: stage latencies, upstream errors, tokens and cache hits."""
+    try:
+        from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+        import metrics  # noqa: F401 (registers the collectors even before the first question)
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    except ImportError as e:
+        return JSONResponse(status_code=503, content={"error": f"Metrics unavailable: {str(e)}"})
+
 @app.post("/api/pipeline")
 async def run_pipeline():
-    """Run the data processing pipeline to populate Weaviate."""
+    """Start a data refresh in the background. Poll /api/pipeline/jobs/{id} for its progress."""
     try:
-        from back_end.pipeline import main as run_pipeline_main
-        logger.info("Starting data processing pipeline...")
-        await run_pipeline_main()
-        return JSONResponse(content={"status": "success", "message": "Pipeline completed successfully"})
+        from jobs import job_runner, PipelineBusy
+        job = job_runner.start()
+    except PipelineBusy as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
     except Exception as e:
         logger.error(f"Pipeline error: {e}")
-        return JSONResponse(status_code=500, content={"error": f"Pipeline failed: {str(e)}"})
+        return JSONResponse(status_code=500, content={"error": f"Pipeline failed to start: {str(e)}"})
+    return JSONResponse(status_code=202, content={
+        "status": "started",
+        "job": job.to_dict(),
+        "status_url": f"/api/pipeline/jobs/{job.id}",
+    })
+
+@app.get("/api/pipeline/jobs")
+async def list_pipeline_jobs():
+    """Recent refreshes, newest first."""
+    from jobs import job_runner
+    return {"jobs": job_runner.jobs()}
+
+@app.get("/api/pipeline/jobs/{job_id}")
+async def get_pipeline_job(job_id: str):
+    """Status and per-stage progress of one refresh."""
+    from jobs import job_runner
+    job = job_runner.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return job.to_dict()
+
+@app.post("/api/pipeline/jobs/{job_id}/cancel")
+async def cancel_pipeline_job(job_id: str):
+    """Ask a running refresh to stop; it is terminated if it has not stopped after a grace period."""
+    from jobs import job_runner
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return job.to_dict()
+
+async def read_question(request: Request):
+    """Parses the question from a JSON request body.
+
+    Returns a (question, error_response) pair where exactly one is set.
+    """
+    body = await request.body()
+    if not body:
+        return None, JSONResponse(status_code=400, content={"error": "Request body is required."})
+    
+    try:
+        data = await request.json()
+    except Exception as json_error:
+        return None, JSONResponse(status_code=400, content={"error": f"Invalid JSON: {str(json_error)}"})
+    
+    question = data.get("question")
+    
+    if not question:
+        return None, JSONResponse(status_code=400, content={"error": "Question is required."})
+    return question, None
+
+def overloaded_response(overloaded):
+    return JSONResponse(
+        status_code=overloaded.status_code,
+        content={"error": f"The service is busy: {overloaded.reason}. Please retry shortly."},
+        headers={"Retry-After": str(overloaded.retry_after)},
+    )
 
 @app.post("/api/ask")
 async def ask(request: Request):
     try:
-        body = await request.body()
-        if not body:
-            return JSONResponse(status_code=400, content={"error": "Request body is required."})
-        
-        try:
-            data = await request.json()
-        except Exception as json_error:
-            return JSONResponse(status_code=400, content={"error": f"Invalid JSON: {str(json_error)}"})
-        
-        question = data.get("question")
-        
-        if not question:
-            return JSONResponse(status_code=400, content={"error": "Question is required."})
-            
-        logger.info(f"Received question: {question}")
-        
+        question, error_response = await read_question(request)
+        if error_response:
+            return error_response
+
         # Try to import and use the agent system
         try:
+            from metrics import log_payload, last_stage
+            from admission import admission, request_deadline, Overloaded
             from back_end.agents.answer_agent import answer_user_question_async
-            result = await answer_user_question_async(question)
+            log_payload("question", question)
+            try:
+                async with admission.admit(), request_deadline():
+                    result = await answer_user_question_async(question)
+            except Overloaded as overloaded:
+                return overloaded_response(overloaded)
+            except TimeoutError:
+                logger.error(f"Request {request.state.request_id} missed its deadline in stage {last_stage() or 'unknown'}")
+                return JSONResponse(status_code=504, content={"error": "The answer took too long. Please try again."})
             
-            logger.info(f"Answer: {result['answer']}")
-            logger.info(f"Sources: {result['sources']}")
+            log_payload("answer", f"{result['answer']} (sources: {result['sources']})")
             
             return JSONResponse(content={
                 "answer": result["answer"],
@@ -98,6 +285,71 @@ async def ask(request: Request):
         logger.error(f"An error occurred in /api/ask: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": f"An internal server error occurred: {str(e)}"})
 
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/ask/stream")
+async def ask_stream(request: Request):
+    """Streams the answer as Server-Sent Events.
+
+    Emits a 'sources' event once retrieval is done, a 'token' event per piece
+    of the answer, then 'done' or 'error'. If the client disconnects the
+    generator is closed, which cancels the upstream completion.
+
+    A full admission queue is rejected with 429 up front. The answer slot
+    itself is taken inside the stream so it is released however the stream
+    ends; a question that waits too long for one gets an 'error' event.
+    Once admitted, the stream has the same deadline and stage budgets as
+    /api/ask, and missing them also ends it with an 'error' event.
+    """
+    question, error_response = await read_question(request)
+    if error_response:
+        return error_response
+
+    try:
+        from metrics import log_payload, last_stage
+        from admission import admission, request_deadline_stream, Overloaded
+        from back_end.agents.answer_agent import stream_answer_async
+    except ImportError as import_error:
+        logger.error(f"Agent import failed: {import_error}")
+        return JSONResponse(status_code=503, content={"error": f"Agent unavailable: {str(import_error)}"})
+    try:
+        admission.check()
+    except Overloaded as overloaded:
+        return overloaded_response(overloaded)
+    log_payload("question", question)
+    request_id = request.state.request_id
+
+    async def event_stream():
+        # Retrieval is over once the sources are out; the completion is not stage-timed until it ends
+        answering = False
+        try:
+            async with admission.admit():
+                # The deadline starts once admitted, as for /api/ask
+                events = request_deadline_stream(stream_answer_async(question))
+                async with aclosing(events):
+                    async for event, data in events:
+                        if await request.is_disconnected():
+                            logger.info("Client disconnected, cancelling answer stream")
+                            return
+                        answering = answering or event == "sources"
+                        yield format_sse(event, data)
+        except Overloaded as overloaded:
+            yield format_sse("error", f"The service is busy: {overloaded.reason}. Please retry shortly.")
+        except TimeoutError:
+            stage = "completion" if answering else last_stage() or "unknown"
+            logger.error(f"Request {request_id} missed its deadline in stage {stage}")
+            yield format_sse("error", "The answer took too long. Please try again.")
+        except Exception as agent_error:
+            logger.error(f"Agent error while streaming: {agent_error}")
+            yield format_sse("error", f"The agent system encountered an error: {str(agent_error)}")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 def run_api():
     """Runs the FastAPI server."""
     port = int(os.getenv("PORT", 8000))  # Use Railway's PORT or default to 8000
@@ -116,13 +368,18 @@ if __name__ == "__main__":
 
     if args.run_pipeline:
         try:
-            from back_end.pipeline import main as run_pipeline
+            from jobs import single_run_lock, PipelineBusy
+            from back_end.pipeline import main as pipeline_main
             logger.info("Starting the data processing pipeline...")
-            asyncio.run(run_pipeline())
+            with single_run_lock():
+                asyncio.run(pipeline_main())
             logger.info("Pipeline finished.")
         except ImportError as e:
             logger.error(f"Pipeline import failed: {e}")
             exit(1)
+        except PipelineBusy as e:
+            logger.error(f"Pipeline not started: {e}")
+            exit(1)
     else:
         logger.info("Starting the FastAPI server...")
         try:
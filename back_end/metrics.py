@@ -0,0 +1,125 @@
+"""
+Prometheus metrics for the question-answering path, served on /metrics.
+
+Stage timings go into one histogram labelled by stage (translate, embed,
+search, context, completion, ...). stage_timer() also adds each duration to
+the current request's timings when begin_request_timings() was called, so a
+request can report its own breakdown.
+
+Question, prompt and answer text is only logged when LOG_PAYLOADS is set,
+and then only for a LOG_PAYLOAD_SAMPLE_RATE fraction of calls.
+"""
+import os
+import time
+import random
+import logging
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() in ("1", "true", "yes")
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_seconds", "Time spent in each stage of answering a question.",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+ANSWER_SECONDS = Histogram(
+    "chatbot_answer_seconds", "End-to-end time to answer a question, by how it was answered.",
+    ["route"], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "chatbot_upstream_errors_total", "Failed calls to upstream services.",
+    ["service", "operation"],
+)
+UPSTREAM_RETRIES = Counter(
+    "chatbot_upstream_retries_total", "Upstream calls that were retried or answered with a retryable status.",
+    ["service"],
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "Tokens sent to (in) and received from (out) the OpenAI API.",
+    ["model", "direction"],
+)
+CACHE_REQUESTS = Counter(
+    "chatbot_cache_requests_total", "Cache lookups by cache and outcome.",
+    ["cache", "result"],
+)
+COALESCED_CALLS = Counter(
+    "chatbot_coalesced_calls_total", "Calls that joined an identical call already in flight.",
+    ["call"],
+)
+ASK_IN_FLIGHT = Gauge("chatbot_ask_in_flight", "Questions being answered.")
+ASK_QUEUED = Gauge("chatbot_ask_queued", "Questions waiting for an answer slot.")
+ADMISSION_REJECTED = Counter(
+    "chatbot_admission_rejected_total", "Questions turned away before being answered.",
+    ["reason"],
+)
+DEADLINE_EXCEEDED = Counter(
+    "chatbot_deadline_exceeded_total", "Stages cut off by their budget or the request deadline.",
+    ["stage"],
+)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_request_id = contextvars.ContextVar("request_id", default="-")
+
+
+def begin_request_timings(request_id="-"):
+    """
+    Starts collecting stage timings for the current request; returns the
+    dict they go into. `request_id` is what the request's log lines quote
+    instead of the question (see current_request_id).
+    """
+    timings = {}
+    _request_timings.set(timings)
+    _request_id.set(request_id)
+    return timings
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+@contextmanager
+def stage_timer(stage):
+    """Times the enclosed block (sync or around awaits) as one observation of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Tasks spawned by the request share the dict; concurrent stages add up
+            # Re-inserted so the stage that ended last comes last (see last_stage)
+            timings[stage] = timings.pop(stage, 0.0) + elapsed
+
+
+def last_stage():
+    """The stage of the current request that ended last, e.g. the one a deadline cut short."""
+    timings = _request_timings.get()
+    return next(reversed(timings), None) if timings else None
+
+
+def observe_answer(route, started):
+    """Records the end-to-end latency of an answer started at time.perf_counter() `started`."""
+    ANSWER_SECONDS.labels(route).observe(time.perf_counter() - started)
+
+
+def record_usage(model, usage):
+    """Counts tokens from an OpenAI usage object (chat or embeddings)."""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model, "in").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(model, "out").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def log_payload(kind, text):
+    """Logs request/response text when payload logging is enabled, for a sample of calls."""
+    if LOG_PAYLOADS and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.info(f"[payload sample] {kind}: {text}")
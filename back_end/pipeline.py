@@ -1,20 +1,39 @@
 import asyncio
 import logging
+import time
 import os
 from scraping.scraper import scrape_site_async, scrape_api_data_async
-from processing.chunking import chunk_data_async, save_chunks_async
-from embedding.embedder import embed_chunks_async
-from scraping.api_fetcher import fetch_and_save_api
-from weaviate_db import upload_chunks_with_embeddings, create_schema
-# If you want to allow user questions:
-from agents.answer_agent import answer_user_question_async
+from processing.chunking import chunk_stream
+from processing.incremental import RefreshTracker
+from embedding.embedder import embed_chunk_stream, EMBEDDING_MODEL
+from embedding.checkpoint import EmbeddingCheckpoint
+from scraping.api_fetcher import fetch_all_apis_async
+from vectordb import get_vector_store
+from agents.answer_cache import AnswerCache
+from sql.metadata import build_database, CUBE_DB_PATH
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def main():
-    # 0. Create Weaviate schema if it doesn't exist
-    create_schema()
+# Bounded queues between stages give back-pressure: a fast producer waits for
+# the embedder instead of buffering the whole corpus in memory.
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 1024))
+# Chunks handed to the vector store per call; the Weaviate writer splits them
+# into concurrent batch requests, so this should cover several of those
+UPLOAD_BATCH_SIZE = int(os.getenv("PIPELINE_UPLOAD_BATCH_SIZE", 1000))
+
+async def main(progress=None):
+    """
+    Runs a full refresh and returns its report. `progress`, when given, is a
+    dict kept up to date with the current stage and running counts (pages
+    crawled, chunks embedded, objects uploaded, ...) for the job runner.
+    """
+    progress = {} if progress is None else progress
+
+    # 0. Create the vector store schema if it doesn't exist
+    progress["stage"] = "schema"
+    vector_store = get_vector_store()
+    await asyncio.to_thread(vector_store.create_schema)
 
     # 1. Fetch data from APIs in both English and Arabic
     endpoints = {
@@ -30,49 +49,155 @@ async def main():
         "sama_money_supply_month": "https://api.datasaudi.sa/tesseract/data.jsonrecords?cube=sama_money_supply_month&drilldowns=Month&measures=Million+SAR"
     }
 
+    # English and Arabic for every cube, fetched concurrently; unchanged cubes are skipped
+    jobs = []
     for name, url in endpoints.items():
-        # Fetch in English
-        fetch_and_save_api(f"{url}&locale=en", f"{name}.en.json")
-        # Fetch in Arabic
-        fetch_and_save_api(f"{url}&locale=ar", f"{name}.ar.json")
-
-    # 2. Scrape web and API
-    html_chunks = await scrape_site_async()
-    api_chunks = await scrape_api_data_async()
-    all_chunks = html_chunks + api_chunks
-
-    # 3. Chunk and Save
-    chunks = await chunk_data_async(all_chunks)
-    await save_chunks_async(chunks)
-
-    # 4. Embed Chunks
-    DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
-    # Create data directory if it doesn't exist
-    os.makedirs(DATA_DIR, exist_ok=True)
-    
-    CHUNKS_FILE = os.path.join(DATA_DIR, 'chunks.json')
-    EMBEDDED_FILE = os.path.join(DATA_DIR, 'chunks_with_embeddings.json')
-    await embed_chunks_async(CHUNKS_FILE, EMBEDDED_FILE)
+        jobs.append((f"{url}&locale=en", f"{name}.en.json"))
+        jobs.append((f"{url}&locale=ar", f"{name}.ar.json"))
+    progress["stage"] = "fetch_apis"
+    fetched = await fetch_all_apis_async(jobs)
+    api_fetch = {status: list(fetched.values()).count(status) for status in ("fetched", "not_modified", "failed")}
+    progress["api_files"] = api_fetch
+    if api_fetch["failed"]:
+        logger.error(f"{api_fetch['failed']} of {len(fetched)} API files could not be fetched")
+    # The raw records also back the SQL fast path for direct indicator lookups.
+    # Rebuild only on new data; otherwise the previous database is still current.
+    if api_fetch["fetched"] or (api_fetch["not_modified"] and not os.path.exists(CUBE_DB_PATH)):
+        progress["stage"] = "build_sql"
+        await asyncio.to_thread(build_database)
+    else:
+        logger.info("No API file changed; keeping the existing cube database")
 
-    # 5. Upload to Weaviate Cloud
-    logger.info("☁️ Uploading data to Weaviate Cloud...")
-    upload_chunks_with_embeddings(EMBEDDED_FILE)
-    
-    # 6. Clean up local temporary files
-    logger.info("🧹 Cleaning up local temporary files...")
-    if os.path.exists(CHUNKS_FILE):
-        os.remove(CHUNKS_FILE)
-    if os.path.exists(EMBEDDED_FILE):
-        os.remove(EMBEDDED_FILE)
-    
-    # Clean up API files
-    apis_dir = os.path.join(DATA_DIR, 'apis')
-    if os.path.exists(apis_dir):
-        import shutil
-        shutil.rmtree(apis_dir)
-        logger.info("🗑️ Removed temporary API files")
+    # 2-5. Scrape -> chunk -> embed -> upload, streamed through bounded queues.
+    # Chunks already in the vector store (same content hash) are not re-embedded.
+    progress["stage"] = "scrape_embed_upload"
+    existing_ids = await asyncio.to_thread(vector_store.get_existing_chunk_ids)
+    tracker = RefreshTracker(existing_ids, vector_store.chunk_id)
+
+    # Embeddings are checkpointed per batch; a run that died before uploading
+    # them resumes from here instead of paying for them again
+    checkpoint = EmbeddingCheckpoint(model=EMBEDDING_MODEL)
+    resumed = await asyncio.to_thread(checkpoint.open)
+    if resumed:
+        logger.info(f"♻️ Resuming with {resumed} chunks embedded by an interrupted run")
+
+    raw_items = asyncio.Queue(maxsize=QUEUE_SIZE)
+    chunks = asyncio.Queue(maxsize=QUEUE_SIZE)
+    new_chunks = asyncio.Queue(maxsize=QUEUE_SIZE)
+    embedded_chunks = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    # Pages and API files read in full this run; only their stale chunks are deleted
+    scraped_sources = set()
+
+    async def scrape_stage():
+        await asyncio.gather(
+            scrape_site_async(out_queue=raw_items, progress=progress, sources=scraped_sources),
+            scrape_api_data_async(out_queue=raw_items, sources=scraped_sources),
+        )
+        await raw_items.put(None)
+
+    async def diff_stage():
+        while (chunk := await chunks.get()) is not None:
+            progress["chunks_seen"] = progress.get("chunks_seen", 0) + 1
+            if not tracker.is_new(chunk):
+                continue
+            if chunk["content_hash"] in checkpoint:
+                progress["chunks_resumed"] = progress.get("chunks_resumed", 0) + 1
+                await embedded_chunks.put({**chunk, "embedding": checkpoint.vector(chunk["content_hash"])})
+            else:
+                await new_chunks.put(chunk)
+        await new_chunks.put(None)
+
+    async def upload_stage():
+        uploaded = failed = 0
+        seconds = 0.0
+        batch = []
+        try:
+            while True:
+                chunk = await embedded_chunks.get()
+                if chunk is not None:
+                    batch.append(chunk)
+                if batch and (chunk is None or len(batch) >= UPLOAD_BATCH_SIZE):
+                    started = time.perf_counter()
+                    failed += await asyncio.to_thread(vector_store.upsert_chunks, batch)
+                    seconds += time.perf_counter() - started
+                    uploaded += len(batch)
+                    progress["objects_uploaded"] = uploaded - failed
+                    progress["objects_failed"] = failed
+                    logger.info(f"☁️ Uploaded {uploaded - failed} new and changed chunks to the vector store")
+                    batch = []
+                if chunk is None:
+                    break
+        finally:
+            started = time.perf_counter()
+            await asyncio.to_thread(vector_store.close_writer)
+            seconds += time.perf_counter() - started
+        rate = (uploaded - failed) / seconds if seconds else 0.0
+        logger.info(f"☁️ Upload: {uploaded - failed} objects in {seconds:.1f}s ({rate:.0f} objects/s), {failed} failed")
+        return {"objects": uploaded - failed, "failed": failed, "seconds": round(seconds, 2), "objects_per_second": round(rate, 1)}
+
+    # A failing stage cancels the others instead of leaving them blocked on a queue
+    async with asyncio.TaskGroup() as stages:
+        stages.create_task(scrape_stage())
+        stages.create_task(chunk_stream(raw_items, chunks))
+        stages.create_task(diff_stage())
+        embedding = stages.create_task(
+            embed_chunk_stream(new_chunks, embedded_chunks, checkpoint=checkpoint, progress=progress)
+        )
+        upload = stages.create_task(upload_stage())
+    if upload.result()["failed"]:
+        # Keep the embeddings so the next run uploads the missing objects without re-embedding them
+        logger.error(f"{upload.result()['failed']} chunks could not be uploaded; keeping the embedding checkpoint")
+    else:
+        # Everything embedded is in the vector store now
+        await asyncio.to_thread(checkpoint.clear)
+
+    progress["stage"] = "cleanup"
+    report = tracker.report(scraped_sources)
+    logger.info(
+        f"Refresh: {report['added']} added, {report['changed']} changed, "
+        f"{report['removed']} removed, {report['unchanged']} unchanged"
+    )
+    report["embedding"] = embedding.result()
+    report["upload"] = upload.result()
+    report["api_fetch"] = api_fetch
+
+    removed_ids = tracker.removed_ids(scraped_sources)
+    kept = len(tracker.removed_ids()) - len(removed_ids)
+    if kept:
+        logger.warning(f"Keeping {kept} chunks from sources that could not be read this run")
+    if not tracker.seen_ids:
+        logger.error("No chunks were produced; leaving existing chunks in place.")
+        removed_ids = []
+    elif removed_ids:
+        logger.info(f"🗑️ Deleting {len(removed_ids)} chunks that are no longer in the source data...")
+        await asyncio.to_thread(vector_store.delete_chunks, removed_ids)
+    progress["objects_deleted"] = len(removed_ids)
+
+    # Reconcile: the store should now hold every chunk seen in this refresh
+    # that was embedded and uploaded, plus the ones kept from sources that
+    # could not be read
+    if tracker.seen_ids:
+        expected = (
+            len(tracker.seen_ids | tracker.existing_ids.keys()) - len(removed_ids)
+            - report["embedding"]["failed"] - report["upload"]["failed"]
+        )
+        stored = await asyncio.to_thread(vector_store.count_chunks)
+        report["reconciliation"] = {"expected": expected, "stored": stored}
+        if stored != expected:
+            logger.warning(f"Vector store holds {stored} chunks, expected {expected}")
+        else:
+            logger.info(f"Vector store holds the expected {stored} chunks")
+
+    if tracker.added_by_source or removed_ids:
+        # Answers cached against the old data are stale now
+        answer_cache = AnswerCache()
+        await answer_cache.invalidate()
+        await answer_cache.close()
     
+    progress["stage"] = "done"
     logger.info("✅ Pipeline finished! Ready for Q&A.")
+    return report
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,6 +1,7 @@
 import os
 import json
 import asyncio
+import hashlib
 import logging
 import re
 
@@ -13,6 +14,18 @@ def detect_language(text):
         return 'ar'
     return 'en'
 
+# Optional filterable properties carried from an item onto its chunks
+METADATA_FIELDS = ("type", "year", "cube", "topic", "period", "quarter", "month", "city", "sector")
+
+def compute_content_hash(chunk):
+    """Stable hash of everything that ends up in the vector store for a chunk."""
+    key = "\0".join(str(chunk.get(field, "")) for field in ("source", "language", "type", "year", "text"))
+    # Fields added later only enter the key when set, so older chunks keep their hash
+    extra = "".join(
+        f"\0{field}={chunk[field]}" for field in METADATA_FIELDS[2:] if chunk.get(field) is not None
+    )
+    return hashlib.sha256((key + extra).encode("utf-8")).hexdigest()
+
 def chunk_text(text, chunk_size=400):
     """Splits text into chunks of N words (default 400)."""
     words = text.split()
@@ -21,6 +34,26 @@ def chunk_text(text, chunk_size=400):
         for i in range(0, len(words), chunk_size)
     ]
 
+def chunk_item(item, chunk_size=400):
+    """
+    Splits one {'source', 'text', ...} dict into chunk dicts with metadata,
+    a score and a content hash.
+    """
+    source = item.get("source", "")
+    text = item.get("text", "")
+    language = item.get("language") or detect_language(text)
+    metadata = {field: item[field] for field in METADATA_FIELDS if item.get(field) is not None}
+    for chunk in chunk_text(text, chunk_size):
+        chunk_dict = {
+            "source": source,
+            "text": chunk,
+            "language": language,
+            "score": 1.0,
+            **metadata,
+        }
+        chunk_dict["content_hash"] = compute_content_hash(chunk_dict)
+        yield chunk_dict
+
 async def chunk_data_async(data, chunk_size=400):
     """
     Takes a list of dicts with 'source', 'text', and optional metadata keys,
@@ -31,30 +64,27 @@ async def chunk_data_async(data, chunk_size=400):
         chunks = []
         seen = set()
         for item in data:
-            source = item.get("source", "")
-            text = item.get("text", "")
-            year = item.get("year")
-            ctype = item.get("type")
-            language = detect_language(text)
-            for chunk in chunk_text(text, chunk_size):
-                chunk_dict = {
-                    "source": source,
-                    "text": chunk,
-                    "language": language,
-                    "score": 1.0
-                }
-                if year is not None:
-                    chunk_dict["year"] = year
-                if ctype is not None:
-                    chunk_dict["type"] = ctype
-                # Deduplication key: text + source + year + language + type
-                dedup_key = (chunk, source, year, language, ctype)
-                if dedup_key not in seen:
-                    seen.add(dedup_key)
+            for chunk_dict in chunk_item(item, chunk_size):
+                # Deduplication key: the hash covers text + source + year + language + type
+                if chunk_dict["content_hash"] not in seen:
+                    seen.add(chunk_dict["content_hash"])
                     chunks.append(chunk_dict)
         return chunks
     return await loop.run_in_executor(None, chunk_all)
 
+async def chunk_stream(in_queue, out_queue, chunk_size=400):
+    """
+    Streaming counterpart of chunk_data_async: reads items from in_queue until
+    a None sentinel, and puts unique chunks on out_queue followed by None.
+    """
+    seen = set()
+    while (item := await in_queue.get()) is not None:
+        for chunk_dict in chunk_item(item, chunk_size):
+            if chunk_dict["content_hash"] not in seen:
+                seen.add(chunk_dict["content_hash"])
+                await out_queue.put(chunk_dict)
+    await out_queue.put(None)
+
 async def save_chunks_async(chunks):
     """
     Saves the chunks to the default CHUNKS_FILE as JSON.
@@ -0,0 +1,73 @@
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+class RefreshTracker:
+    """
+    Tracks a refresh against what the vector store already holds, one chunk
+    at a time, so it can sit in the middle of a streaming pipeline.
+
+    Because object ids derive from content, an edited chunk shows up as one
+    new id plus one removed id under the same source; the report counts such
+    pairs as 'changed'.
+    """
+
+    def __init__(self, existing_ids, chunk_id):
+        """
+        Args:
+            existing_ids: Mapping of stored object id -> source.
+            chunk_id: Function mapping a content hash to the store's object id.
+        """
+        self.existing_ids = existing_ids
+        self.chunk_id = chunk_id
+        self.seen_ids = set()
+        self.added_by_source = Counter()
+
+    def is_new(self, chunk):
+        """Records the chunk and returns True if it must be embedded and uploaded."""
+        object_id = self.chunk_id(chunk["content_hash"])
+        if object_id in self.seen_ids:
+            return False
+        self.seen_ids.add(object_id)
+        if object_id in self.existing_ids:
+            return False
+        self.added_by_source[chunk.get("source")] += 1
+        return True
+
+    def removed_ids(self, sources=None):
+        """
+        Stored ids that did not appear in this refresh. With `sources`, only
+        ids from those sources count: a page or cube that failed to fetch or
+        parse this time keeps its chunks instead of losing all of them.
+        """
+        missing = self.existing_ids.keys() - self.seen_ids
+        if sources is not None:
+            missing = {i for i in missing if self.existing_ids[i] in sources}
+        return sorted(missing)
+
+    def report(self, sources=None):
+        removed_ids = self.removed_ids(sources)
+        removed_by_source = Counter(self.existing_ids[i] for i in removed_ids)
+        new_count = sum(self.added_by_source.values())
+        changed = sum(
+            min(count, removed_by_source[source]) for source, count in self.added_by_source.items()
+        )
+        return {
+            "added": new_count - changed,
+            "changed": changed,
+            "removed": len(removed_ids) - changed,
+            "unchanged": len(self.seen_ids) - new_count,
+        }
+
+def plan_refresh(chunks, existing_ids, chunk_id):
+    """
+    Compares freshly chunked data with what the vector store already holds.
+
+    Returns:
+        (new_chunks, removed_ids, report). Only new_chunks need embedding and
+        uploading, and removed_ids should be deleted.
+    """
+    tracker = RefreshTracker(existing_ids, chunk_id)
+    new_chunks = [chunk for chunk in chunks if tracker.is_new(chunk)]
+    return new_chunks, tracker.removed_ids(), tracker.report()
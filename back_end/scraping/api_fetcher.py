@@ -1,12 +1,27 @@
-import requests
 import os
 import json
+import random
+import asyncio
+import logging
+import httpx
+from .http_cache import HTTPCache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+API_DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'apis')
+FETCH_CONCURRENCY = int(os.getenv("API_FETCH_CONCURRENCY", 8))
+FETCH_TIMEOUT = float(os.getenv("API_FETCH_TIMEOUT", 60))
+FETCH_RETRIES = int(os.getenv("API_FETCH_RETRIES", 3))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 def fetch_and_save_api(url, filename):
+    # Only this legacy synchronous fetcher needs requests; keep it out of the API process
+    import requests
     response = requests.get(url)
     response.raise_for_status()
     data = response.json()
-    # Save to temporary apis directory (will be cleaned up after processing)
+    # Save to the apis directory read by scrape_api_data_async
     data_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'apis')
     os.makedirs(data_dir, exist_ok=True)
     out_path = os.path.join(data_dir, filename)
@@ -14,5 +29,86 @@ def fetch_and_save_api(url, filename):
         json.dump(data, f, ensure_ascii=False, indent=2)
     print(f"📥 API data from {url} saved to {out_path}")
 
+def _write_atomic(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def _retry_delay(attempt, response=None):
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+async def fetch_and_save_api_async(client, cache, url, filename):
+    """
+    Conditionally fetches one API endpoint and saves the body under data/apis.
+
+    Returns 'fetched', 'not_modified' or 'failed'.
+    """
+    out_path = os.path.abspath(os.path.join(API_DATA_DIR, filename))
+    for attempt in range(FETCH_RETRIES + 1):
+        try:
+            headers = await cache.conditional_headers(url)
+            response = await client.get(url, headers=headers)
+            if response.status_code == 304:
+                await cache.touch(url)
+                logger.info(f"⏭️ {filename} unchanged, skipping download")
+                return "not_modified"
+            if response.status_code in RETRY_STATUSES and attempt < FETCH_RETRIES:
+                delay = _retry_delay(attempt, response)
+                logger.warning(f"{url} returned {response.status_code}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            await asyncio.to_thread(_write_atomic, out_path, response.content)
+            await cache.store(url, response, out_path)
+            logger.info(f"📥 API data from {url} saved to {out_path}")
+            return "fetched"
+        except httpx.TransportError as e:
+            if attempt < FETCH_RETRIES:
+                delay = _retry_delay(attempt)
+                logger.warning(f"Fetching {url} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            logger.error(f"Failed to fetch {url}: {e!r}")
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Failed to fetch {url}: {e}")
+        return "failed"
+    return "failed"
+
+async def fetch_all_apis_async(jobs, concurrency=FETCH_CONCURRENCY):
+    """
+    Fetches (url, filename) jobs concurrently with a bounded number in flight,
+    using ETag/Last-Modified revalidation so unchanged endpoints are skipped.
+
+    Returns {filename: 'fetched' | 'not_modified' | 'failed'}.
+    """
+    os.makedirs(API_DATA_DIR, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    cache = await HTTPCache().open()
+    # httpx sends Accept-Encoding: gzip and decompresses transparently
+    async with httpx.AsyncClient(
+        timeout=httpx.Timeout(FETCH_TIMEOUT, connect=10),
+        limits=httpx.Limits(max_connections=concurrency),
+        follow_redirects=True,
+    ) as client:
+        async def run(url, filename):
+            async with semaphore:
+                return filename, await fetch_and_save_api_async(client, cache, url, filename)
+
+        try:
+            results = dict(await asyncio.gather(*(run(url, filename) for url, filename in jobs)))
+        finally:
+            await cache.close()
+
+    counts = {status: list(results.values()).count(status) for status in ("fetched", "not_modified", "failed")}
+    logger.info(
+        f"API fetch done: {counts['fetched']} fetched, {counts['not_modified']} unchanged, "
+        f"{counts['failed']} failed"
+    )
+    return results
+
 # Example usage:
-# fetch_and_save_api('https://api.example.com/data', 'example.json')
\ No newline at end of file
+# fetch_and_save_api('https://api.example.com/data', 'example.json')
@@ -0,0 +1,70 @@
+import os
+import time
+import aiosqlite
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+HTTP_CACHE_DB = os.path.join(DATA_DIR, 'http_cache.sqlite3')
+
+class HTTPCache:
+    """
+    Local store of HTTP validators (ETag / Last-Modified) per URL, pointing at
+    the file that holds the last response body. Used to send conditional
+    requests and skip downloads of unchanged resources.
+    """
+
+    def __init__(self, db_path=HTTP_CACHE_DB):
+        self.db_path = db_path
+        self._db = None
+
+    async def open(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = await aiosqlite.connect(self.db_path, timeout=10)
+            await self._db.execute("PRAGMA journal_mode=WAL")
+            await self._db.execute(
+                "CREATE TABLE IF NOT EXISTS http_cache ("
+                " url TEXT PRIMARY KEY,"
+                " etag TEXT,"
+                " last_modified TEXT,"
+                " body_path TEXT NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+            await self._db.commit()
+        return self
+
+    async def get(self, url):
+        """Returns the cached entry for url if its body file still exists, else None."""
+        async with self._db.execute(
+            "SELECT etag, last_modified, body_path, fetched_at FROM http_cache WHERE url = ?", (url,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None or not os.path.exists(row[2]):
+            return None
+        return {"etag": row[0], "last_modified": row[1], "body_path": row[2], "fetched_at": row[3]}
+
+    async def conditional_headers(self, url):
+        entry = await self.get(url)
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def store(self, url, response, body_path):
+        await self._db.execute(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body_path, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, response.headers.get("etag"), response.headers.get("last-modified"), body_path, time.time()),
+        )
+        await self._db.commit()
+
+    async def touch(self, url):
+        await self._db.execute("UPDATE http_cache SET fetched_at = ? WHERE url = ?", (time.time(), url))
+        await self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
@@ -1,11 +1,15 @@
 import os
 import json
+import time
+import hashlib
 import logging
-import requests
-from bs4 import BeautifulSoup
 import asyncio
-from urllib.parse import urljoin, urlparse
 import collections
+import httpx
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin, urlparse
+from .http_cache import HTTPCache, DATA_DIR
+from sql.metadata import record_metadata
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +17,11 @@ logger = logging.getLogger(__name__)
 REQUEST_HEADERS = {
     'User-Agent': 'DataSaudiChatbot/1.0 (https://datasaudi.sa; mailto:admin@example.com)'
 }
-MAX_PAGES_TO_CRAWL = 20 # Safety limit for the crawler
+MAX_PAGES_TO_CRAWL = int(os.getenv("MAX_PAGES_TO_CRAWL", 20)) # Safety limit for the crawler
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", 8)) # Concurrent fetch workers
+CRAWL_DELAY = float(os.getenv("CRAWL_DELAY", 0.25)) # Seconds between requests to one host
+PARSE_WORKERS = int(os.getenv("CRAWL_PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+PAGE_CACHE_DIR = os.path.join(DATA_DIR, 'page_cache')
 
 # --- HTML Scraping (Crawler) ---
 
@@ -23,69 +31,197 @@ def canonicalize_url(base_url, link):
     parsed = urlparse(full_url)
     return parsed._replace(fragment="").geturl()
 
-async def scrape_site_async(start_url="https://datasaudi.sa/en/"):
+def parse_page(url, html):
+    """
+    Extracts text/table chunks and outgoing links from one HTML page.
+    Runs in a worker process, so it must stay a picklable top-level function.
+    """
+    # Imported here: the API process only needs this module's formatters
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "lxml")
+    chunks = []
+
+    # --- Extract meaningful content ---
+    if soup.title and soup.title.string:
+        chunks.append({"source": url, "text": f"[TITLE] {soup.title.string.strip()}"})
+    
+    meta_desc = soup.find("meta", attrs={"name": "description"})
+    if meta_desc and meta_desc.get("content"):
+        chunks.append({"source": url, "text": f"[DESC] {meta_desc.get('content').strip()}"})
+
+    for tag in soup.find_all(['h1', 'h2', 'h3', 'p', 'li']):
+        text = tag.get_text(strip=True)
+        if len(text) > 25:
+            chunks.append({"source": url, "text": text})
+
+    for table in soup.find_all("table"):
+        for row in table.find_all("tr"):
+            cells = [cell.get_text(strip=True) for cell in row.find_all(["th", "td"])]
+            if cells and any(cells):
+                text = " | ".join(cells)
+                chunks.append({"source": url, "text": f"[TABLE] {text}"})
+
+    # --- Find new links to crawl ---
+    links = [canonicalize_url(url, a_tag['href']) for a_tag in soup.find_all("a", href=True)]
+    for chunk in chunks:
+        chunk["type"] = "page"
+    return chunks, links
+
+class HostThrottle:
+    """Spaces out request starts to the same host by at least `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._next_allowed = {}
+        self._locks = collections.defaultdict(asyncio.Lock)
+
+    async def wait(self, url):
+        host = urlparse(url).netloc
+        async with self._locks[host]:
+            now = time.monotonic()
+            next_allowed = self._next_allowed.get(host, now)
+            if next_allowed > now:
+                await asyncio.sleep(next_allowed - now)
+            self._next_allowed[host] = max(now, next_allowed) + self.delay
+
+def _read_file(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+def _write_file(path, text):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+async def fetch_page(client, cache, throttle, url):
+    """
+    Fetches a page, revalidating against the on-disk cache. Returns the HTML
+    (from the cache on a 304), or None for non-HTML responses.
+    """
+    headers = await cache.conditional_headers(url)
+    await throttle.wait(url)
+    response = await client.get(url, headers=headers)
+
+    if response.status_code == 304:
+        entry = await cache.get(url)
+        return await asyncio.to_thread(_read_file, entry["body_path"])
+
+    response.raise_for_status()
+    if "html" not in response.headers.get("content-type", "html"):
+        return None
+
+    body_path = os.path.join(PAGE_CACHE_DIR, hashlib.sha256(url.encode("utf-8")).hexdigest() + '.html')
+    await asyncio.to_thread(_write_file, body_path, response.text)
+    await cache.store(url, response, body_path)
+    return response.text
+
+async def cached_page(cache, url):
+    """The last stored body for url, or None if it was never fetched."""
+    entry = await cache.get(url)
+    if entry is None:
+        return None
+    return await asyncio.to_thread(_read_file, entry["body_path"])
+
+async def scrape_site_async(start_url="https://datasaudi.sa/en/", max_pages=MAX_PAGES_TO_CRAWL, concurrency=CRAWL_CONCURRENCY, out_queue=None, progress=None, sources=None):
     """
     Crawls a website starting from a given URL, scraping text and table data
-    up to a maximum number of pages.
+    up to a maximum number of pages. Pages are fetched by `concurrency`
+    workers with a per-host politeness delay, revalidated against an on-disk
+    cache, and parsed in a process pool so the event loop never blocks.
+
+    Returns the chunks, or streams them into `out_queue` as each page is
+    parsed (and returns an empty list) when a queue is given. A `progress`
+    dict gets a running "pages_crawled" count. The URL of every page that
+    was read (fresh or, after a fetch error, from the cache) or is gone
+    (404/410) is added to the `sources` set, if given.
     """
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     all_chunks = []
+    chunk_count = 0
     
     domain = urlparse(start_url).netloc
-    # Use a deque for an efficient queue and a set to track all seen URLs
-    urls_to_visit = collections.deque([start_url])
+    # A queue shared by the workers and a set to track all seen URLs
+    urls_to_visit = asyncio.Queue()
+    urls_to_visit.put_nowait(start_url)
     visited_urls = {start_url}
     pages_crawled = 0
 
-    while urls_to_visit and pages_crawled < MAX_PAGES_TO_CRAWL:
-        url = urls_to_visit.popleft()
-        pages_crawled += 1
-        logger.info(f"Scraping page {pages_crawled}/{MAX_PAGES_TO_CRAWL}: {url}")
+    os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+    cache = await HTTPCache().open()
+    throttle = HostThrottle(CRAWL_DELAY)
 
-        try:
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.get(url, headers=REQUEST_HEADERS, timeout=10)
-            )
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, "lxml")
-
-            # --- Extract meaningful content ---
-            if soup.title and soup.title.string:
-                all_chunks.append({"source": url, "text": f"[TITLE] {soup.title.string.strip()}"})
-            
-            meta_desc = soup.find("meta", attrs={"name": "description"})
-            if meta_desc and meta_desc.get("content"):
-                all_chunks.append({"source": url, "text": f"[DESC] {meta_desc.get('content').strip()}"})
-
-            for tag in soup.find_all(['h1', 'h2', 'h3', 'p', 'li']):
-                text = tag.get_text(strip=True)
-                if len(text) > 25:
-                    all_chunks.append({"source": url, "text": text})
-
-            for table in soup.find_all("table"):
-                for row in table.find_all("tr"):
-                    cells = [cell.get_text(strip=True) for cell in row.find_all(["th", "td"])]
-                    if cells and any(cells):
-                        text = " | ".join(cells)
-                        all_chunks.append({"source": url, "text": f"[TABLE] {text}"})
-
-            # --- Find new links to crawl ---
-            for a_tag in soup.find_all("a", href=True):
-                new_url = canonicalize_url(url, a_tag['href'])
-                if urlparse(new_url).netloc == domain and new_url not in visited_urls:
-                    visited_urls.add(new_url)
-                    urls_to_visit.append(new_url)
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch {url}: {e}")
-        except Exception as e:
-            logger.error(f"An error occurred while scraping {url}: {e}")
-
-    if pages_crawled >= MAX_PAGES_TO_CRAWL:
-        logger.warning(f"Crawler reached max page limit of {MAX_PAGES_TO_CRAWL}.")
+    async def worker(client, pool):
+        nonlocal pages_crawled, chunk_count
+        while True:
+            url = await urls_to_visit.get()
+            try:
+                pages_crawled += 1
+                if progress is not None:
+                    progress["pages_crawled"] = pages_crawled
+                logger.info(f"Scraping page {pages_crawled}/{max_pages}: {url}")
+                try:
+                    html = await fetch_page(client, cache, throttle, url)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in (404, 410):
+                        raise
+                    # Gone for good: its stored chunks may be removed
+                    logger.warning(f"{url} returned {e.response.status_code}")
+                    html = None
+                except httpx.HTTPError as e:
+                    html = await cached_page(cache, url)
+                    if html is None:
+                        raise
+                    logger.warning(f"Failed to fetch {url} ({e!r}), using the cached copy")
+                if html is None:
+                    if sources is not None:
+                        sources.add(url)
+                    continue
+                chunks, links = await loop.run_in_executor(pool, parse_page, url, html)
+                if sources is not None:
+                    sources.add(url)
+                chunk_count += len(chunks)
+                if out_queue is None:
+                    all_chunks.extend(chunks)
+                else:
+                    for chunk in chunks:
+                        await out_queue.put(chunk)
+
+                for new_url in links:
+                    if len(visited_urls) >= max_pages:
+                        break
+                    if urlparse(new_url).netloc == domain and new_url not in visited_urls:
+                        visited_urls.add(new_url)
+                        urls_to_visit.put_nowait(new_url)
+            except httpx.HTTPError as e:
+                logger.error(f"Failed to fetch {url}: {e!r}")
+            except Exception as e:
+                logger.error(f"An error occurred while scraping {url}: {e}")
+            finally:
+                urls_to_visit.task_done()
+
+    try:
+        with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+            async with httpx.AsyncClient(
+                headers=REQUEST_HEADERS,
+                timeout=10,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=concurrency),
+            ) as client:
+                workers = [asyncio.create_task(worker(client, pool)) for _ in range(concurrency)]
+                try:
+                    await urls_to_visit.join()
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        await cache.close()
+
+    if len(visited_urls) >= max_pages:
+        logger.warning(f"Crawler reached max page limit of {max_pages}.")
         
-    logger.info(f"Total HTML chunks scraped from {pages_crawled} pages: {len(all_chunks)}")
+    logger.info(f"Total HTML chunks scraped from {pages_crawled} pages: {chunk_count}")
     return all_chunks
 
 # --- API Data Formatting ---
@@ -155,8 +291,14 @@ API_FORMATTERS = {
 }
 
 # --- API Scraping ---
-async def scrape_api_data_async():
+async def scrape_api_data_async(out_queue=None, sources=None):
+    """
+    Formats every saved API record as a text chunk. Returns the chunks, or
+    streams them into `out_queue` (and returns an empty list) when given.
+    The name of every file read completely is added to the `sources` set, if given.
+    """
     api_chunks = []
+    chunk_count = 0
     data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'apis'))
     
     if not os.path.exists(data_dir):
@@ -176,6 +318,7 @@ async def scrape_api_data_async():
             records = data.get('data', [])
             lang = 'ar' if '.ar.json' in filename else 'en'
             formatter = next((func for key, func in API_FORMATTERS.items() if key in filename), None)
+            cube = filename.split('.')[0]
 
             for row in records:
                 if not isinstance(row, dict):
@@ -187,10 +330,20 @@ async def scrape_api_data_async():
                     text = " | ".join([f"{k}: {v}" for k, v in row.items()])
                 
                 if text:
-                    api_chunks.append({"source": filename, "text": text})
+                    chunk_count += 1
+                    item = {
+                        "source": filename, "text": text, "type": "api", "language": lang,
+                        **record_metadata(cube, row),
+                    }
+                    if out_queue is None:
+                        api_chunks.append(item)
+                    else:
+                        await out_queue.put(item)
+            if sources is not None:
+                sources.add(filename)
 
         except Exception as ex:
             logger.error(f"Failed to process {file_path}: {ex}")
 
-    logger.info(f"Total API indicator chunks processed: {len(api_chunks)}")
+    logger.info(f"Total API indicator chunks processed: {chunk_count}")
     return api_chunks
@@ -0,0 +1,95 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+While a call for a key is in flight, later callers with the same key wait
+for its result instead of starting their own. Nothing is kept once the call
+finishes, so this is not a cache; it only flattens bursts of the same
+question.
+
+The shared call runs in its own task. A waiter that is cancelled (a client
+disconnecting) leaves the others unaffected; the call is only cancelled when
+its last waiter goes away.
+"""
+import asyncio
+from metrics import COALESCED_CALLS
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+async def _pick(batch, index):
+    # Shielded: one key's waiters leaving must not cancel the request for the others
+    return (await asyncio.shield(batch))[index]
+
+
+class SingleFlight:
+    """Coalesces concurrent calls by key. `name` labels the coalesced-calls metric."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    def _start(self, key, coro):
+        call = _Call(asyncio.create_task(coro))
+        self._calls[key] = call
+        call.task.add_done_callback(lambda _: self._forget(key, call))
+        return call
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _join(self, key):
+        call = self._calls.get(key)
+        if call is not None:
+            COALESCED_CALLS.labels(self.name).inc()
+        return call
+
+    @staticmethod
+    async def _wait(call):
+        # The caller has already counted itself in call.waiters
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1:
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    async def do(self, key, factory):
+        """Returns the result of factory() for key, sharing it with concurrent callers."""
+        call = self._join(key) or self._start(key, factory())
+        call.waiters += 1
+        return await self._wait(call)
+
+    async def do_many(self, keys, fetch):
+        """
+        Returns one result per key. Keys already in flight are joined; the
+        rest are fetched together by a single fetch(new_keys) call, which
+        returns results in the order of new_keys.
+        """
+        calls = {key: self._join(key) for key in dict.fromkeys(keys)}
+        new = [key for key, call in calls.items() if call is None]
+        if new:
+            batch = asyncio.create_task(fetch(new))
+            items = []
+            for index, key in enumerate(new):
+                calls[key] = self._start(key, _pick(batch, index))
+                items.append(calls[key].task)
+
+            def cancel_orphaned_batch(_):
+                if all(item.done() for item in items):
+                    batch.cancel()
+
+            for item in items:
+                item.add_done_callback(cancel_orphaned_batch)
+
+        for key in keys:
+            calls[key].waiters += 1
+        return list(await asyncio.gather(*(self._wait(calls[key]) for key in keys)))
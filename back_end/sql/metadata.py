@@ -0,0 +1,291 @@
+"""
+Catalogue of the tesseract cubes and the loader that turns the raw API
+records in data/apis into indexed SQLite tables.
+
+Every dataset fetched by the pipeline becomes one table with a row per
+record and locale. Besides the dimension and measure columns, each row keeps
+the parsed period (year, quarter, month; 0 when not applicable) for indexed
+lookups and the original record as JSON so answers can be rendered with the
+same formatters as the RAG chunks.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+from scraping.api_fetcher import API_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+CUBE_DB_PATH = os.getenv("CUBE_DB_PATH", os.path.join(DATA_DIR, 'cubes.sqlite3'))
+
+# Time levels from coarsest to finest
+TIME_LEVELS = ("Year", "Quarter", "Month")
+
+# Words that identify a topic in a question, in English and Arabic
+TOPICS = {
+    "gdp": ["gdp", "gross domestic product", "الناتج المحلي"],
+    "inflation": ["inflation", "consumer price", "cpi", "التضخم", "أسعار المستهلك"],
+    "wpi": ["wholesale", "wpi", "أسعار الجملة"],
+    "ipi": ["industrial production", "ipi", "الإنتاج الصناعي"],
+    "pmi": ["pmi", "purchasing manager", "مديري المشتريات"],
+    "government_finance": [
+        "government revenue", "government expenditure", "revenues", "expenditures",
+        "الإيرادات", "النفقات", "المصروفات",
+    ],
+    "money_supply": ["money supply", "عرض النقود"],
+}
+
+# One entry per dataset fetched by the pipeline (see the endpoints in pipeline.py)
+CUBE_TABLES = {
+    "gastat_gdp_quarter": {
+        "topic": "gdp", "time_level": "Quarter",
+        "dimensions": ["Economic Activity Section"], "measures": ["GDP"],
+    },
+    "gastat_gdp_year": {
+        "topic": "gdp", "time_level": "Year",
+        "dimensions": ["Economic Activity Section"], "measures": ["GDP"],
+    },
+    "gastat_inflation_city_yoy": {
+        "topic": "inflation", "time_level": "Year",
+        "dimensions": ["City"], "measures": ["Inflation", "Consumer Price Index"],
+    },
+    "gastat_inflation_city_mom": {
+        "topic": "inflation", "time_level": "Month",
+        "dimensions": ["City"], "measures": ["Inflation", "Consumer Price Index"],
+    },
+    "gastat_wpi_city_yoy": {
+        "topic": "wpi", "time_level": "Year",
+        "dimensions": ["City"], "measures": ["Wholesale Price Index Growth", "Wholesale Price Index"],
+    },
+    "gastat_ipi_index_economic_activity": {
+        "topic": "ipi", "time_level": "Month",
+        "dimensions": ["Economic Sectors"], "measures": ["Industrial Production Index", "Percentage change"],
+    },
+    "pmi": {
+        "topic": "pmi", "time_level": "Month",
+        "dimensions": [], "measures": ["Purchasing Manager Index"],
+    },
+    "mof_government_revenues_expenditures_quarter": {
+        "topic": "government_finance", "time_level": "Quarter",
+        "dimensions": ["Type"], "measures": ["SAR Billions"],
+    },
+    "sama_money_supply_year": {
+        "topic": "money_supply", "time_level": "Year",
+        "dimensions": [], "measures": ["Million SAR"],
+    },
+    "sama_money_supply_month": {
+        "topic": "money_supply", "time_level": "Month",
+        "dimensions": [], "measures": ["Million SAR"],
+    },
+}
+
+LOCALES = ("en", "ar")
+
+# Chunk properties filled from a cube dimension, for filtering the vector search
+DIMENSION_PROPERTIES = {
+    "City": "city",
+    "Economic Activity Section": "sector",
+    "Economic Sectors": "sector",
+}
+
+# --- Text and period normalization (shared with the question router) ---
+
+_ARABIC_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+_ARABIC_LETTERS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه", "ـ": None})
+_ARABIC_DIACRITICS = re.compile(r"[ً-ْ]")
+
+
+def normalize(text):
+    """Case-folds and normalizes digits and Arabic letter variants for matching."""
+    text = _ARABIC_DIACRITICS.sub("", str(text).translate(_ARABIC_DIGITS))
+    return text.translate(_ARABIC_LETTERS).casefold()
+
+
+MONTHS = {
+    **{name: i + 1 for i, name in enumerate([
+        "january", "february", "march", "april", "may", "june", "july",
+        "august", "september", "october", "november", "december"])},
+    **{name: i + 1 for i, name in enumerate([
+        "jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])},
+    "sept": 9,
+    **{normalize(name): i + 1 for i, name in enumerate([
+        "يناير", "فبراير", "مارس", "أبريل", "مايو", "يونيو", "يوليو",
+        "أغسطس", "سبتمبر", "أكتوبر", "نوفمبر", "ديسمبر"])},
+}
+
+QUARTERS = {
+    "first quarter": 1, "second quarter": 2, "third quarter": 3, "fourth quarter": 4,
+    normalize("الربع الأول"): 1, normalize("الربع الثاني"): 2,
+    normalize("الربع الثالث"): 3, normalize("الربع الرابع"): 4,
+}
+
+_YEAR = re.compile(r"(?<!\d)((?:19|20)\d\d)(?!\d)")
+_QUARTER = re.compile(r"\bq([1-4])\b")
+_YEAR_MONTH = re.compile(r"(?<!\d)((?:19|20)\d\d)[-/](0?[1-9]|1[0-2])(?!\d)")
+_WORD = re.compile(r"\w+")
+
+
+def find_years(text):
+    return [int(y) for y in _YEAR.findall(normalize(text))]
+
+
+def find_month(text):
+    text = normalize(text)
+    match = _YEAR_MONTH.search(text)
+    if match:
+        return int(match.group(2))
+    for word in _WORD.findall(text):
+        if word in MONTHS:
+            return MONTHS[word]
+    return None
+
+
+def find_quarter(text):
+    text = normalize(text)
+    match = _QUARTER.search(text)
+    if match:
+        return int(match.group(1))
+    for phrase, quarter in QUARTERS.items():
+        if phrase in text:
+            return quarter
+    return None
+
+
+def parse_period(label, period_id=None):
+    """Returns (year, quarter, month) for a period label such as '2024', 'Q1 2024' or 'March 2024'."""
+    period_id = str(period_id or "")
+    if re.fullmatch(r"(19|20)\d\d(0[1-9]|1[0-2])", period_id):
+        year, month = int(period_id[:4]), int(period_id[4:])
+        return year, (month - 1) // 3 + 1, month
+    if re.fullmatch(r"(19|20)\d\d[1-4]", period_id):
+        return int(period_id[:4]), int(period_id[4]), 0
+
+    years = find_years(label)
+    year = years[0] if years else 0
+    month = find_month(label) or 0
+    quarter = find_quarter(label) or ((month - 1) // 3 + 1 if month else 0)
+    return year, quarter, month
+
+
+def record_metadata(table, record):
+    """
+    Filterable chunk properties for one API record: cube, topic, period
+    (label, year, quarter, month) and city or sector where the cube has them.
+    """
+    spec = CUBE_TABLES.get(table)
+    if spec is None:
+        return {"cube": table}
+    metadata = {"cube": table, "topic": spec["topic"]}
+    level = spec["time_level"]
+    label = record.get(level)
+    year, quarter, month = parse_period(label or "", record.get(f"{level} ID"))
+    if year:
+        metadata.update(period=str(label), year=year, quarter=quarter, month=month)
+    for dimension, prop in DIMENSION_PROPERTIES.items():
+        if dimension in spec["dimensions"] and record.get(dimension):
+            metadata[prop] = record[dimension]
+    return metadata
+
+
+def column_name(name):
+    """SQL column name for a dimension or measure ('Economic Activity Section' -> 'economic_activity_section')."""
+    return re.sub(r"\W+", "_", name.strip()).strip("_").lower()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Loading ---
+
+def _create_table(conn, table, spec):
+    dimensions = [f'"{column_name(d)}" TEXT' for d in spec["dimensions"]]
+    measures = [f'"{column_name(m)}" REAL' for m in spec["measures"]]
+    conn.execute(
+        f'CREATE TABLE "{table}" ('
+        " locale TEXT NOT NULL, period TEXT, year INTEGER NOT NULL,"
+        " quarter INTEGER NOT NULL, month INTEGER NOT NULL,"
+        f" {', '.join(dimensions + measures + ['record TEXT NOT NULL'])})"
+    )
+    conn.execute(f'CREATE INDEX "ix_{table}_period" ON "{table}" (locale, year, quarter, month)')
+    for dimension in spec["dimensions"]:
+        column = column_name(dimension)
+        conn.execute(f'CREATE INDEX "ix_{table}_{column}" ON "{table}" (locale, "{column}", year)')
+
+
+def _load_table(conn, table, spec, api_dir):
+    columns = [f'"{column_name(c)}"' for c in spec["dimensions"] + spec["measures"]]
+    insert = (
+        f'INSERT INTO "{table}" (locale, period, year, quarter, month, {", ".join(columns)}, record) '
+        f'VALUES ({", ".join("?" * (len(columns) + 6))})'
+    )
+    level = spec["time_level"]
+    sources, count = [], 0
+    for locale in LOCALES:
+        filename = f"{table}.{locale}.json"
+        path = os.path.join(api_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f).get("data", [])
+        rows = []
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            label = record.get(level)
+            year, quarter, month = parse_period(label or "", record.get(f"{level} ID"))
+            if not year:
+                continue
+            rows.append((
+                locale, label, year, quarter, month,
+                *(record.get(d) for d in spec["dimensions"]),
+                *(_number(record.get(m)) for m in spec["measures"]),
+                json.dumps(record, ensure_ascii=False),
+            ))
+        conn.executemany(insert, rows)
+        sources.append(filename)
+        count += len(rows)
+    return sources, count
+
+
+def build_database(api_dir=API_DATA_DIR, db_path=CUBE_DB_PATH):
+    """
+    Rebuilds the cube database from the saved API files. The new database is
+    written next to the old one and swapped in atomically, so readers never
+    see a half-built file.
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE catalogue ("
+            " table_name TEXT PRIMARY KEY, topic TEXT NOT NULL, time_level TEXT NOT NULL,"
+            " dimensions TEXT NOT NULL, measures TEXT NOT NULL, sources TEXT NOT NULL,"
+            " row_count INTEGER NOT NULL, loaded_at REAL NOT NULL)"
+        )
+        total = 0
+        for table, spec in CUBE_TABLES.items():
+            _create_table(conn, table, spec)
+            sources, count = _load_table(conn, table, spec, api_dir)
+            conn.execute(
+                "INSERT INTO catalogue VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (table, spec["topic"], spec["time_level"], json.dumps(spec["dimensions"]),
+                 json.dumps(spec["measures"]), json.dumps(sources), count, time.time()),
+            )
+            total += count
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    logger.info(f"Loaded {total} cube records into {db_path}")
+    return total
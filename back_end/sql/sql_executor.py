@@ -0,0 +1,158 @@
+"""
+Read side of the cube database: routes a question through the SQL fast path
+and renders the matching records with the same formatters the pipeline uses
+for RAG chunks.
+"""
+import os
+import json
+import sqlite3
+import asyncio
+import logging
+from contextlib import closing
+from scraping.scraper import API_FORMATTERS
+from metrics import CACHE_REQUESTS
+from .metadata import CUBE_DB_PATH, DIMENSION_PROPERTIES, LOCALES, column_name
+from .sql_generator import parse_question, generate_sql, MIN_DIMENSION_VALUE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS = 24
+
+
+def format_records(table, records, language, measures):
+    """Renders records as markdown, one sentence per record, with the values in bold."""
+    formatter = next((func for key, func in API_FORMATTERS.items() if key in table), None)
+    lines = []
+    for record in records:
+        shown = {k: (f"**{v}**" if k in measures and v is not None else v) for k, v in record.items()}
+        if formatter:
+            lines.append(formatter(shown, language))
+        else:
+            lines.append(" | ".join(f"{k}: {v}" for k, v in shown.items()))
+    if len(lines) == 1:
+        return lines[0]
+    return "\n".join(f"- {line}" for line in lines)
+
+
+class CubeStore:
+    """Answers direct indicator lookups from the SQLite tables built by sql.metadata.
+
+    Each query opens a short-lived read-only connection, so the store is safe
+    to use from worker threads, and picks up a rebuilt database (swapped in
+    by the pipeline) on the next call. The catalogue and the distinct
+    dimension values used by the router are cached per database version.
+    """
+
+    def __init__(self, db_path=CUBE_DB_PATH, max_rows=DEFAULT_MAX_ROWS):
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self._version = None
+        self._catalogue = {}
+        self._dimension_values = {}
+        self._place_names = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def _refresh(self):
+        """Reloads the catalogue when the database file changed. Returns False if there is none."""
+        try:
+            version = os.path.getmtime(self.db_path)
+        except FileNotFoundError:
+            return False
+        if version != self._version:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    "SELECT table_name, topic, time_level, dimensions, measures, sources, row_count "
+                    "FROM catalogue"
+                ).fetchall()
+            self._catalogue = {
+                name: {
+                    "topic": topic,
+                    "time_level": level,
+                    "dimensions": json.loads(dimensions),
+                    "measures": json.loads(measures),
+                    "sources": json.loads(sources),
+                    "row_count": row_count,
+                }
+                for name, topic, level, dimensions, measures, sources, row_count in rows
+            }
+            self._dimension_values = {}
+            self._place_names = None
+            self._version = version
+        return True
+
+    def catalogue(self):
+        return self._catalogue if self._refresh() else {}
+
+    def dimension_values(self, table, dimension, locale):
+        key = (table, dimension, locale)
+        if key not in self._dimension_values:
+            column = column_name(dimension)
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    f'SELECT DISTINCT "{column}" FROM "{table}" WHERE locale = ?', (locale,)
+                ).fetchall()
+            self._dimension_values[key] = [row[0] for row in rows if row[0]]
+        return self._dimension_values[key]
+
+    def place_names(self):
+        """Every city and sector name in the cubes, in all locales."""
+        try:
+            catalogue = self.catalogue()
+            if self._place_names is None:
+                self._place_names = sorted({
+                    value
+                    for table, spec in catalogue.items()
+                    for dimension in spec["dimensions"] if dimension in DIMENSION_PROPERTIES
+                    for locale in LOCALES
+                    for value in self.dimension_values(table, dimension, locale)
+                    if len(value) >= MIN_DIMENSION_VALUE_LENGTH
+                })
+        except sqlite3.Error as e:
+            logger.warning(f"Could not load place names: {e}")
+            return []
+        return self._place_names
+
+    def execute(self, sql, params):
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def answer(self, question, language):
+        """Returns {"answer", "sources"} for a direct lookup, or None to fall back to RAG."""
+        try:
+            catalogue = self.catalogue()
+            if not catalogue:
+                return None
+            lookup = parse_question(question, language, catalogue, self.dimension_values)
+            if lookup is None:
+                return None
+            sql, params = generate_sql(lookup, self.max_rows + 1)
+            rows = self.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.warning(f"SQL fast path failed, falling back to RAG: {e}")
+            return None
+
+        if not rows or len(rows) > self.max_rows:
+            # Nothing to show, or too broad for a lookup; let the model summarize instead
+            self.fallbacks += 1
+            CACHE_REQUESTS.labels("sql_fast_path", "fallback").inc()
+            return None
+
+        self.hits += 1
+        CACHE_REQUESTS.labels("sql_fast_path", "hit").inc()
+        table = lookup["table"]
+        records = [json.loads(row[0]) for row in rows]
+        logger.info(f"SQL fast path answered from {table} ({len(records)} rows)")
+        return {
+            "answer": format_records(table, records, language, catalogue[table]["measures"]),
+            "sources": [f"{table}.{language}.json"],
+        }
+
+    async def answer_async(self, question, language):
+        return await asyncio.to_thread(self.answer, question, language)
+
+    def stats(self):
+        return {"hits": self.hits, "fallbacks": self.fallbacks}
@@ -0,0 +1,146 @@
+"""
+Recognizes direct indicator lookups ("PMI for March 2024", "التضخم في الرياض
+2023") and turns them into parameterized SQL over the cube tables.
+
+Anything that is not a single indicator at a single period (comparisons,
+trends, explanations, questions matching several topics or none) is left to
+the RAG path by returning None.
+"""
+import re
+from .metadata import (
+    TOPICS, TIME_LEVELS, normalize, column_name, find_years, find_month, find_quarter,
+)
+
+# Phrasings that ask for analysis rather than a value
+ANALYSIS_WORDS = [
+    "why", "compare", "comparison", "trend", "forecast", "predict", "explain",
+    "difference", "versus", "vs", "between", "highest", "lowest", "average",
+    "لماذا", "قارن", "مقارنة", "اتجاه", "توقع", "اشرح", "الفرق", "أعلى", "أدنى", "متوسط",
+]
+# Relative periods depend on today's date, which the tables do not know about
+RELATIVE_PERIODS = [
+    "last year", "last month", "last quarter", "previous year", "this year",
+    "العام الماضي", "السنة الماضية", "الشهر الماضي", "الربع الماضي", "هذا العام",
+]
+LATEST_WORDS = ["latest", "most recent", "current", "last", "آخر", "أحدث", "الحالي"]
+
+# Dimension values shorter than this are too ambiguous to match inside a question
+MIN_DIMENSION_VALUE_LENGTH = 3
+
+
+def contains_phrase(text, phrase):
+    """Whole-word match for Latin phrases, substring match for Arabic ones."""
+    phrase = normalize(phrase)
+    if phrase.isascii():
+        return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+    return phrase in text
+
+
+def match_topics(text):
+    """Every topic named in a normalized question."""
+    return [topic for topic, words in TOPICS.items() if any(contains_phrase(text, w) for w in words)]
+
+
+def match_topic(text):
+    topics = match_topics(text)
+    return topics[0] if len(topics) == 1 else None
+
+
+def _pick_table(tables, month, quarter, year, latest):
+    """Chooses the table whose time level answers the question most directly."""
+    by_level = {spec["time_level"]: name for name, spec in tables.items()}
+    if month:
+        preference = ["Month"]
+    elif quarter:
+        preference = ["Quarter"]
+    elif year:
+        preference = list(TIME_LEVELS)
+    elif latest:
+        preference = list(reversed(TIME_LEVELS))
+    else:
+        return None
+    return next((by_level[level] for level in preference if level in by_level), None)
+
+
+def parse_question(question, language, catalogue, dimension_values):
+    """
+    Returns a lookup dictionary for a direct indicator lookup, or None.
+
+    Args:
+        catalogue: {table: {"topic", "time_level", "dimensions", "measures"}}.
+        dimension_values: Function (table, dimension, locale) -> distinct values.
+    """
+    text = normalize(question)
+    if any(contains_phrase(text, word) for word in ANALYSIS_WORDS + RELATIVE_PERIODS):
+        return None
+
+    topic = match_topic(text)
+    if topic is None:
+        return None
+
+    years = set(find_years(text))
+    if len(years) > 1:
+        return None
+    year = years.pop() if years else None
+    # A month or quarter name only counts next to a year ("may" is also a verb)
+    month = find_month(text) if year else None
+    quarter = find_quarter(text) if year and not month else None
+    latest = year is None and any(contains_phrase(text, word) for word in LATEST_WORDS)
+
+    tables = {
+        name: spec for name, spec in catalogue.items()
+        if spec["topic"] == topic and spec.get("row_count", 1)
+    }
+    table = _pick_table(tables, month, quarter, year, latest)
+    if table is None:
+        return None
+
+    filters = {}
+    for dimension in catalogue[table]["dimensions"]:
+        matches = [
+            value for value in dimension_values(table, dimension, language)
+            if value and len(value) >= MIN_DIMENSION_VALUE_LENGTH and contains_phrase(text, value)
+        ]
+        if matches:
+            # "Eastern Region" should win over "Region"
+            filters[dimension] = max(matches, key=len)
+
+    return {
+        "table": table,
+        "locale": language,
+        "year": year,
+        "quarter": quarter,
+        "month": month,
+        "latest": latest,
+        "filters": filters,
+    }
+
+
+def generate_sql(lookup, limit):
+    """Builds (sql, params) for a lookup. Identifiers come from the catalogue, values are bound."""
+    table = lookup["table"]
+    conditions = ["locale = ?"]
+    params = [lookup["locale"]]
+    for dimension, value in lookup["filters"].items():
+        conditions.append(f'"{column_name(dimension)}" = ?')
+        params.append(value)
+
+    if lookup["latest"]:
+        # The most recent period that has data for the requested dimensions
+        latest = (
+            f'SELECT year, quarter, month FROM "{table}" WHERE {" AND ".join(conditions)} '
+            "ORDER BY year DESC, quarter DESC, month DESC LIMIT 1"
+        )
+        params = params + params
+        conditions = conditions + [f"(year, quarter, month) = ({latest})"]
+    else:
+        for field in ("year", "quarter", "month"):
+            if lookup[field]:
+                conditions.append(f"{field} = ?")
+                params.append(lookup[field])
+
+    sql = (
+        f'SELECT record FROM "{table}" WHERE {" AND ".join(conditions)} '
+        f"ORDER BY year, quarter, month LIMIT ?"
+    )
+    return sql, params + [limit]
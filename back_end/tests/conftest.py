@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules import each other from back_end/ (e.g. `from metrics import ...`)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,80 @@
+import asyncio
+import numpy as np
+from agents.answer_cache import AnswerCache
+from agents.search_filter import question_facts
+
+PLACES = ["Riyadh", "Jeddah", "الرياض", "جدة"]
+# Near-duplicates embed almost identically; use the same vector to isolate the facts check
+EMBEDDING = np.ones(8, dtype=np.float32)
+
+
+def cached_answer(tmp_path, stored_question, asked_question, language="en"):
+    async def run():
+        cache = AnswerCache(db_path=str(tmp_path / "cache.sqlite3"))
+        try:
+            await cache.store(stored_question, language, EMBEDDING, "cached answer", ["src"],
+                              question_facts(stored_question, PLACES))
+            return await cache.lookup(EMBEDDING, language, question_facts(asked_question, PLACES))
+        finally:
+            await cache.close()
+    return asyncio.run(run())
+
+
+def test_same_question_hits(tmp_path):
+    hit = cached_answer(tmp_path, "Inflation in Riyadh in 2022?", "inflation in riyadh in 2022")
+    assert hit and hit["answer"] == "cached answer"
+
+
+def test_different_year_misses(tmp_path):
+    assert cached_answer(tmp_path, "Inflation in Riyadh in 2022?", "Inflation in Riyadh in 2023?") is None
+
+
+def test_different_city_misses(tmp_path):
+    assert cached_answer(tmp_path, "Inflation in Riyadh in 2022?", "Inflation in Jeddah in 2022?") is None
+
+
+def test_different_month_misses(tmp_path):
+    assert cached_answer(tmp_path, "PMI for March 2024", "PMI for April 2024") is None
+
+
+def test_different_indicator_misses(tmp_path):
+    assert cached_answer(tmp_path, "GDP in 2022", "Inflation in 2022") is None
+
+
+def test_arabic_digits_and_city(tmp_path):
+    assert cached_answer(tmp_path, "التضخم في الرياض ٢٠٢٢", "التضخم في الرياض 2022", "ar")
+    assert cached_answer(tmp_path, "التضخم في الرياض 2022", "التضخم في جدة 2022", "ar") is None
+
+
+def test_entries_without_facts_do_not_match_a_lookup_with_facts(tmp_path):
+    async def run():
+        cache = AnswerCache(db_path=str(tmp_path / "cache.sqlite3"))
+        try:
+            await cache.store("GDP in 2022", "en", EMBEDDING, "old answer", [])
+            return await cache.lookup(EMBEDDING, "en", question_facts("GDP in 2022", PLACES))
+        finally:
+            await cache.close()
+    assert asyncio.run(run()) is None
+
+
+def test_load_keeps_the_newest_entries_aligned_with_their_vectors(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    vectors = np.eye(8, dtype=np.float32)
+
+    async def run():
+        writer = AnswerCache(db_path=db_path, max_entries=5)
+        for i, vector in enumerate(vectors):
+            await writer.store(f"q{i}", "en", vector, f"answer {i}", [])
+        await writer.close()
+        reader = AnswerCache(db_path=db_path, max_entries=5)
+        try:
+            await reader.open()
+            return reader.stats()["entries"], [
+                (await reader.lookup(vector, "en") or {}).get("answer") for vector in vectors
+            ]
+        finally:
+            await reader.close()
+
+    entries, answers = asyncio.run(run())
+    assert entries == 5
+    assert answers == [None] * 3 + [f"answer {i}" for i in range(3, 8)]
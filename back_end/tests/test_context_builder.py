@@ -0,0 +1,45 @@
+from agents.context_builder import collapse_duplicates
+
+
+def record(text, language, distance, **properties):
+    return {"properties": {"text": text, "language": language, **properties}, "distance": distance}
+
+
+def test_same_figures_for_different_cities_are_kept():
+    chunks = [
+        record("Inflation in Riyadh in 2022 was 2.5%", "en", 0.1,
+               cube="gastat_inflation_city_yoy", year=2022, city="Riyadh"),
+        record("Inflation in Jeddah in 2022 was 2.5%", "en", 0.2,
+               cube="gastat_inflation_city_yoy", year=2022, city="Jeddah"),
+    ]
+    assert len(collapse_duplicates(chunks, "en")) == 2
+
+
+def test_renderings_of_one_record_collapse_to_the_question_language():
+    chunks = [
+        record("بلغ مؤشر مديري المشتريات 56.8 في مارس 2024", "ar", 0.1,
+               cube="pmi", year=2024, quarter=1, month=3),
+        record("PMI was 56.8 in March 2024", "en", 0.2, cube="pmi", year=2024, quarter=1, month=3),
+    ]
+    kept = collapse_duplicates(chunks, "en")
+    assert len(kept) == 1
+    assert kept[0]["properties"]["language"] == "en" and kept[0]["distance"] == 0.1
+
+
+def test_undescribed_dimensions_fall_back_to_the_text():
+    chunks = [
+        record("Revenues in Q1 2024 were 100", "en", 0.1,
+               cube="mof_government_revenues_expenditures_quarter", year=2024, quarter=1),
+        record("Expenditures in Q1 2024 were 100", "en", 0.2,
+               cube="mof_government_revenues_expenditures_quarter", year=2024, quarter=1),
+    ]
+    assert len(collapse_duplicates(chunks, "en")) == 2
+
+
+def test_pages_collapse_only_on_identical_text():
+    chunks = [
+        record("About  DataSaudi", "en", 0.1, type="page"),
+        record("about datasaudi", "en", 0.2, type="page"),
+        record("Contact DataSaudi", "en", 0.3, type="page"),
+    ]
+    assert len(collapse_duplicates(chunks, "en")) == 2
@@ -0,0 +1,39 @@
+"""
+Pluggable retrieval backends behind the search_chunks interface.
+
+VECTOR_BACKEND selects the backend: "weaviate" (default) searches the
+Weaviate `Chunk` collection, "numpy" searches an in-process memory-mapped
+matrix built by the pipeline, with no network dependency.
+"""
+import os
+from metrics import UPSTREAM_ERRORS
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "weaviate").lower()
+
+_vector_store = None
+
+
+def get_vector_store():
+    """Returns the process-wide store for the configured backend."""
+    global _vector_store
+    if _vector_store is None:
+        if VECTOR_BACKEND == "numpy":
+            from .numpy_store import NumpyVectorStore
+            _vector_store = NumpyVectorStore()
+        elif VECTOR_BACKEND == "weaviate":
+            from .weaviate_store import WeaviateVectorStore
+            _vector_store = WeaviateVectorStore()
+        else:
+            raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    return _vector_store
+
+
+async def search_chunks_async(query_embedding, top_k=10, where=None, include_vector=False):
+    try:
+        return await get_vector_store().search_async(
+            query_embedding, top_k=top_k, where=where, include_vector=include_vector
+        )
+    except Exception:
+        UPSTREAM_ERRORS.labels(VECTOR_BACKEND, "search").inc()
+        raise
+
@@ -0,0 +1,74 @@
+"""
+Backend-neutral search filters.
+
+Filters are plain dicts in the shape of Weaviate's GraphQL `where` argument,
+so both backends accept the same value:
+
+    {"operator": "Equal", "path": ["language"], "valueText": "en"}
+    {"operator": "And", "operands": [<filter>, <filter>, ...]}
+
+Leaf operators are Equal, NotEqual, GreaterThan, GreaterThanEqual, LessThan,
+LessThanEqual and ContainsAny; And/Or combine any number of operands.
+"""
+
+VALUE_KEYS = ("valueText", "valueInt", "valueNumber", "valueBoolean", "valueTextArray", "valueIntArray")
+
+
+def _value_key(value):
+    if isinstance(value, (list, tuple, set)):
+        return "valueIntArray" if all(isinstance(v, int) for v in value) else "valueTextArray"
+    if isinstance(value, bool):
+        return "valueBoolean"
+    if isinstance(value, int):
+        return "valueInt"
+    if isinstance(value, float):
+        return "valueNumber"
+    return "valueText"
+
+
+def value_of(where):
+    """The compared value of a leaf filter."""
+    return next(where[key] for key in VALUE_KEYS if key in where)
+
+
+def compare(operator, prop, value):
+    if isinstance(value, (set, tuple)):
+        value = list(value)
+    return {"operator": operator, "path": [prop], _value_key(value): value}
+
+
+def equal(prop, value):
+    return compare("Equal", prop, value)
+
+
+def contains_any(prop, values):
+    return compare("ContainsAny", prop, list(values))
+
+
+def between(prop, low=None, high=None):
+    """Inclusive range; either bound may be None."""
+    if low is not None and low == high:
+        return equal(prop, low)
+    bounds = []
+    if low is not None:
+        bounds.append(compare("GreaterThanEqual", prop, low))
+    if high is not None:
+        bounds.append(compare("LessThanEqual", prop, high))
+    return all_of(*bounds)
+
+
+def _combine(operator, operands):
+    operands = [operand for operand in operands if operand is not None]
+    if len(operands) <= 1:
+        return operands[0] if operands else None
+    return {"operator": operator, "operands": operands}
+
+
+def all_of(*operands):
+    """And of the operands, ignoring None; a single operand is returned as is."""
+    return _combine("And", operands)
+
+
+def any_of(*operands):
+    """Or of the operands, ignoring None; a single operand is returned as is."""
+    return _combine("Or", operands)
@@ -0,0 +1,362 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+import numpy as np
+from embedding.checkpoint import EmbeddingCheckpoint
+from .filters import value_of
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+NUMPY_STORE_DIR = os.getenv("NUMPY_STORE_DIR", os.path.join(DATA_DIR, 'vectors'))
+VECTORS_FILE = 'vectors.npy'
+METADATA_FILE = 'metadata.jsonl'
+# Batches written through upsert_chunks(), merged into the store by close_writer()
+PENDING_VECTORS_FILE = 'pending.f32'
+PENDING_METADATA_FILE = 'pending.jsonl'
+# Two-stage search: dimensions of the coarse prefix index (0 = exact search only)
+# and how many candidates per requested result are rescored at full width
+PREFIX_DIMS = int(os.getenv("NUMPY_PREFIX_DIMS", 0))
+RESCORE_FACTOR = int(os.getenv("NUMPY_RESCORE_FACTOR", 10))
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest finite scores, best first."""
+    k = min(k, int(np.count_nonzero(np.isfinite(scores))))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class _Snapshot:
+    """
+    One consistent version of the store: the mapped matrix, its prefix index
+    and the row properties. Never modified after construction, except for
+    the lazily built filter columns, which derive from the same rows.
+    """
+
+    def __init__(self, matrix, properties, prefix, mtime):
+        self.matrix = matrix
+        self.properties = properties
+        self.prefix = prefix
+        self.mtime = mtime
+        self._columns = {}
+
+    def column(self, name):
+        """Property values as an array, for vectorized filtering."""
+        if name not in self._columns:
+            self._columns[name] = np.array([p.get(name) for p in self.properties], dtype=object)
+        return self._columns[name]
+
+    def numeric_column(self, name):
+        """Property values as floats, NaN where missing, so range comparisons skip those rows."""
+        key = (name, float)
+        if key not in self._columns:
+            self._columns[key] = np.array(
+                [np.nan if v is None else v for v in self.column(name)], dtype=np.float64
+            )
+        return self._columns[key]
+
+    def filter_mask(self, where):
+        """Boolean row mask for a vectordb.filters dict. Missing values never match, as in Weaviate."""
+        operator = where["operator"]
+        if operator in ("And", "Or"):
+            masks = [self.filter_mask(operand) for operand in where["operands"]]
+            return np.logical_and.reduce(masks) if operator == "And" else np.logical_or.reduce(masks)
+
+        name, value = where["path"][-1], value_of(where)
+        if operator == "Equal":
+            return self.column(name) == value
+        if operator == "NotEqual":
+            column = self.column(name)
+            return (column != value) & (column != None)  # noqa: E711 (elementwise)
+        if operator == "ContainsAny":
+            values = set(value)
+            column = self.column(name)
+            return np.fromiter((v in values for v in column), dtype=bool, count=len(column))
+        comparisons = {
+            "GreaterThan": np.greater,
+            "GreaterThanEqual": np.greater_equal,
+            "LessThan": np.less,
+            "LessThanEqual": np.less_equal,
+        }
+        if operator in comparisons:
+            with np.errstate(invalid="ignore"):
+                return comparisons[operator](self.numeric_column(name), value)
+        raise NotImplementedError(f"Unsupported filter operator: {operator}")
+
+
+class NumpyVectorStore:
+    """Exact in-process vector search over a memory-mapped float32 matrix.
+
+    Vectors are stored L2-normalized in a .npy file and opened with
+    mmap_mode='r', so several workers on one host share the same page-cache
+    pages. Properties live in a JSONL sidecar, one line per row. A search is
+    one matrix-vector product followed by argpartition. Distances are cosine
+    distances (1 - similarity), the same metric Weaviate reports.
+
+    With prefix_dims set, search runs in two stages. text-embedding-3 vectors
+    keep most of their meaning in the leading dimensions, so the first
+    prefix_dims columns, renormalized, are held in RAM as a compact coarse
+    index. The top_k * rescore_factor best coarse candidates are then rescored
+    exactly against their full-width rows in the memory-mapped file.
+    benchmarks/truncated_retrieval.py measures recall against exact search.
+
+    Searches run in worker threads while the pipeline may rewrite the files.
+    Each reload builds a new _Snapshot and swaps it in with one assignment,
+    and a search only uses the snapshot it picked up when it started.
+    """
+
+    def __init__(self, store_dir=NUMPY_STORE_DIR, prefix_dims=PREFIX_DIMS, rescore_factor=RESCORE_FACTOR):
+        self.store_dir = store_dir
+        self.prefix_dims = prefix_dims
+        self.rescore_factor = rescore_factor
+        self.vectors_path = os.path.join(store_dir, VECTORS_FILE)
+        self.metadata_path = os.path.join(store_dir, METADATA_FILE)
+        self._snapshot = None
+        # Serializes reloads; searches never take it
+        self._load_lock = threading.Lock()
+        self.pending_vectors_path = os.path.join(store_dir, PENDING_VECTORS_FILE)
+        self.pending_metadata_path = os.path.join(store_dir, PENDING_METADATA_FILE)
+        # Shape of the rows appended by upsert_chunks() since the last close_writer()
+        self._pending_dim = None
+        self._pending_rows = 0
+
+    # --- Loading ---
+
+    def _read_snapshot(self):
+        mtime = os.stat(self.vectors_path).st_mtime_ns
+        matrix = np.load(self.vectors_path, mmap_mode='r')
+        if os.stat(self.vectors_path).st_mtime_ns != mtime:
+            raise ValueError(f"{self.vectors_path} was replaced while loading")
+        # The metadata mtime comes from the opened file, so it describes what was read
+        with open(self.metadata_path, encoding='utf-8') as f:
+            metadata_mtime = os.fstat(f.fileno()).st_mtime_ns
+            properties = [json.loads(line) for line in f if line.strip()]
+        # _write_rows writes metadata before vectors; newer metadata belongs to a write in progress
+        if metadata_mtime > mtime:
+            raise ValueError(f"{self.store_dir} is being rewritten")
+        if len(properties) != matrix.shape[0]:
+            raise ValueError(
+                f"{self.metadata_path} has {len(properties)} rows but "
+                f"{self.vectors_path} has {matrix.shape[0]}"
+            )
+        prefix = None
+        if 0 < self.prefix_dims < matrix.shape[1]:
+            prefix = normalize_rows(np.ascontiguousarray(matrix[:, :self.prefix_dims]))
+        logger.info(f"Loaded {len(properties)} vectors from {self.vectors_path}")
+        return _Snapshot(matrix, properties, prefix, mtime)
+
+    def load(self):
+        with self._load_lock:
+            self._snapshot = self._read_snapshot()
+        return self._snapshot
+
+    def snapshot(self):
+        """
+        The current snapshot, reloaded first if the pipeline rewrote the
+        files. None when there is no store yet.
+        """
+        current = self._snapshot
+        try:
+            mtime = os.stat(self.vectors_path).st_mtime_ns
+        except FileNotFoundError:
+            if current is None:
+                logger.error(f"No vector store found at {self.store_dir}; run the pipeline first")
+            return current
+        if current is not None and mtime == current.mtime:
+            return current
+        with self._load_lock:
+            # Another thread may have reloaded while this one waited
+            if self._snapshot is not None and self._snapshot.mtime == mtime:
+                return self._snapshot
+            try:
+                self._snapshot = self._read_snapshot()
+            except (OSError, ValueError) as e:
+                # Caught between the two file replacements; retried on the next search
+                if self._snapshot is None:
+                    raise
+                logger.warning(f"Keeping the loaded vectors, reload failed: {e}")
+            return self._snapshot
+
+    # --- Search ---
+
+    def search(self, query_embedding, top_k=10, where=None, include_vector=False):
+        snapshot = self.snapshot()
+        if snapshot is None or not snapshot.properties:
+            return []
+
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        mask = snapshot.filter_mask(where) if where else None
+
+        if snapshot.prefix is not None:
+            # Coarse pass over the in-memory prefix, exact rescoring of the shortlist
+            coarse = snapshot.prefix @ normalize_rows(query[:self.prefix_dims])
+            if mask is not None:
+                coarse = np.where(mask, coarse, -np.inf)
+            # Sorted row order reads the memory-mapped file front to back
+            rows = np.sort(top_k_indices(coarse, top_k * self.rescore_factor))
+            scores = snapshot.matrix[rows] @ query
+            best = top_k_indices(scores, top_k)
+            top, top_scores = rows[best], scores[best]
+        else:
+            scores = snapshot.matrix @ query
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            top = top_k_indices(scores, top_k)
+            top_scores = scores[top]
+
+        results = []
+        for i, score in zip(top, top_scores):
+            result = {"properties": dict(snapshot.properties[i]), "distance": float(1.0 - score)}
+            if include_vector:
+                result["vector"] = np.array(snapshot.matrix[i])
+            results.append(result)
+        return results
+
+    async def search_async(self, query_embedding, top_k=10, where=None, include_vector=False):
+        # NumPy releases the GIL in the matmul, so a thread keeps the loop responsive
+        return await asyncio.to_thread(self.search, query_embedding, top_k, where, include_vector)
+
+    # --- Writing ---
+
+    def _read_rows(self):
+        """Returns the (properties, matrix) currently on disk."""
+        if not os.path.exists(self.vectors_path):
+            return [], None
+        matrix = np.load(self.vectors_path)
+        with open(self.metadata_path, encoding='utf-8') as f:
+            properties = [json.loads(line) for line in f if line.strip()]
+        return properties, matrix
+
+    def _write_rows(self, properties, matrix):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_vectors = self.vectors_path + '.tmp.npy'
+        tmp_metadata = self.metadata_path + '.tmp'
+        # Metadata is written (and so timestamped) before the vectors; see _read_snapshot
+        with open(tmp_metadata, 'w', encoding='utf-8') as f:
+            for row in properties:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        np.save(tmp_vectors, np.ascontiguousarray(matrix, dtype=np.float32))
+        # Metadata first: readers reload when the vectors file changes
+        os.replace(tmp_metadata, self.metadata_path)
+        os.replace(tmp_vectors, self.vectors_path)
+        logger.info(f"Wrote {len(properties)} vectors to {self.vectors_path}")
+
+    @staticmethod
+    def _row_id(properties, index):
+        return properties.get("content_hash") or f"row-{index}"
+
+    def upsert(self, chunks):
+        """Adds chunks (dicts with an 'embedding'), replacing rows with the same content hash."""
+        rows = [chunk for chunk in chunks if chunk.get("embedding") is not None]
+        if not rows:
+            return
+        new_properties = [{k: v for k, v in chunk.items() if k != "embedding"} for chunk in rows]
+        self._merge(new_properties, np.stack([np.asarray(chunk["embedding"], dtype=np.float32) for chunk in rows]))
+
+    def _merge(self, new_properties, new_matrix):
+        """Writes the stored rows plus the new ones, which replace rows with the same content hash."""
+        new_matrix = normalize_rows(new_matrix)
+        properties, matrix = self._read_rows()
+        if matrix is not None and len(properties):
+            replaced = {self._row_id(p, len(properties) + i) for i, p in enumerate(new_properties)}
+            keep = [i for i, p in enumerate(properties) if self._row_id(p, i) not in replaced]
+            new_properties = [properties[i] for i in keep] + new_properties
+            new_matrix = np.vstack([matrix[keep], new_matrix])
+        self._write_rows(new_properties, new_matrix)
+
+    def write(self, chunks):
+        """Replaces the whole store with the given chunks."""
+        rows = [chunk for chunk in chunks if chunk.get("embedding") is not None]
+        properties = [{k: v for k, v in chunk.items() if k != "embedding"} for chunk in rows]
+        matrix = normalize_rows(np.array([chunk["embedding"] for chunk in rows], dtype=np.float32))
+        self._write_rows(properties, matrix)
+
+    # --- Vector store interface ---
+
+    async def connect(self):
+        await asyncio.to_thread(self.snapshot)
+
+    async def close(self):
+        self._snapshot = None
+
+    def create_schema(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def upload_chunks_with_embeddings(self, embedded_dir):
+        checkpoint = EmbeddingCheckpoint(embedded_dir)
+        checkpoint.open()
+        self.upsert([chunk for batch in checkpoint.iter_batches() for chunk in batch])
+        return 0
+
+    def upsert_chunks(self, chunks):
+        # Rewriting the matrix per batch would be quadratic; append the batch
+        # to the pending files and merge them once in close_writer()
+        rows = [chunk for chunk in chunks if chunk.get("embedding") is not None]
+        if not rows:
+            return 0
+        matrix = np.asarray([chunk["embedding"] for chunk in rows], dtype=np.float32)
+        if self._pending_dim is None:
+            # Leftovers of an interrupted run were never merged; start over
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._remove_pending()
+            self._pending_dim = matrix.shape[1]
+        elif matrix.shape[1] != self._pending_dim:
+            raise ValueError(f"Expected {self._pending_dim}-dim embeddings, got {matrix.shape[1]}")
+        with open(self.pending_vectors_path, 'ab') as f:
+            f.write(matrix.tobytes())
+        with open(self.pending_metadata_path, 'a', encoding='utf-8') as f:
+            for chunk in rows:
+                f.write(json.dumps({k: v for k, v in chunk.items() if k != "embedding"}, ensure_ascii=False) + "\n")
+        self._pending_rows += len(rows)
+        return 0
+
+    def close_writer(self):
+        if self._pending_dim is None:
+            return
+        try:
+            matrix = np.memmap(
+                self.pending_vectors_path, dtype=np.float32, mode='r', shape=(self._pending_rows, self._pending_dim)
+            )
+            with open(self.pending_metadata_path, encoding='utf-8') as f:
+                properties = [json.loads(line) for line in f if line.strip()]
+            self._merge(properties, matrix)
+        finally:
+            self._remove_pending()
+            self._pending_dim, self._pending_rows = None, 0
+
+    def _remove_pending(self):
+        for path in (self.pending_vectors_path, self.pending_metadata_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def chunk_id(self, content_hash):
+        return content_hash
+
+    def get_existing_chunk_ids(self):
+        """Returns {row id: source} for every stored row."""
+        properties, _ = self._read_rows()
+        return {self._row_id(p, i): p.get("source") for i, p in enumerate(properties)}
+
+    def count_chunks(self):
+        if not os.path.exists(self.metadata_path):
+            return 0
+        with open(self.metadata_path, encoding='utf-8') as f:
+            return sum(1 for line in f if line.strip())
+
+    def delete_chunks(self, ids):
+        ids = set(ids)
+        properties, matrix = self._read_rows()
+        keep = [i for i, p in enumerate(properties) if self._row_id(p, i) not in ids]
+        if len(keep) < len(properties):
+            self._write_rows([properties[i] for i in keep], matrix[keep])
@@ -0,0 +1,49 @@
+import weaviate_db
+
+
+class WeaviateVectorStore:
+    """Vector store backed by the Weaviate `Chunk` collection."""
+
+    def __init__(self):
+        # Sync client used by the pipeline for batch writes, opened on first use
+        self._writer = None
+
+    async def connect(self):
+        await weaviate_db.weaviate_manager.connect()
+
+    async def close(self):
+        await weaviate_db.weaviate_manager.close()
+
+    async def search_async(self, query_embedding, top_k=10, where=None, include_vector=False):
+        return await weaviate_db.search_chunks_async(
+            query_embedding, top_k=top_k, where=where, include_vector=include_vector
+        )
+
+    def create_schema(self):
+        weaviate_db.create_schema()
+
+    def upload_chunks_with_embeddings(self, embedded_dir):
+        return weaviate_db.upload_chunks_with_embeddings(embedded_dir)
+
+    def upsert_chunks(self, chunks):
+        """Writes chunks, retrying rejected objects. Returns how many could not be written."""
+        if self._writer is None:
+            self._writer = weaviate_db.get_weaviate_client()
+        return weaviate_db.upsert_chunks(self._writer, chunks)
+
+    def close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def chunk_id(self, content_hash):
+        return weaviate_db.chunk_id(content_hash)
+
+    def get_existing_chunk_ids(self):
+        return weaviate_db.get_existing_chunk_ids()
+
+    def delete_chunks(self, ids):
+        weaviate_db.delete_chunks(ids)
+
+    def count_chunks(self):
+        return weaviate_db.count_chunks()
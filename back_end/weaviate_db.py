@@ -1,15 +1,37 @@
 import weaviate
 import numpy as np
 import os
-import json
+import time
+import random
+import asyncio
+import logging
 from dotenv import load_dotenv
+from weaviate.util import generate_uuid5
+from weaviate.classes.config import Property, DataType, Tokenization
+from weaviate.exceptions import (
+    WeaviateClosedClientError,
+    WeaviateConnectionError,
+    WeaviateGRPCUnavailableError,
+)
 from weaviate.collections.classes.filters import Filter
-from weaviate.collections.classes.batch import BatchObject
 from weaviate.collections.classes.grpc import MetadataQuery
+from embedding.checkpoint import EmbeddingCheckpoint, EMBEDDED_DIR
+from vectordb.filters import value_of
+from metrics import UPSTREAM_RETRIES, UPSTREAM_ERRORS
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Seconds between readiness probes of the shared async client
+HEALTH_CHECK_INTERVAL = float(os.getenv("WEAVIATE_HEALTH_CHECK_INTERVAL", 30))
+# Batch uploads: objects per request, requests in flight, and attempts per object
+UPLOAD_BATCH_OBJECTS = int(os.getenv("WEAVIATE_UPLOAD_BATCH_OBJECTS", 100))
+UPLOAD_CONCURRENCY = int(os.getenv("WEAVIATE_UPLOAD_CONCURRENCY", 4))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("WEAVIATE_UPLOAD_MAX_ATTEMPTS", 5))
+UPLOAD_MAX_BACKOFF = float(os.getenv("WEAVIATE_UPLOAD_MAX_BACKOFF", 30))
+
 SCHEMA = {
     "classes": [
         {
@@ -18,10 +40,20 @@ SCHEMA = {
             "properties": [
                 {"name": "text", "dataType": ["text"]},
                 {"name": "source", "dataType": ["text"]},
-                {"name": "year", "dataType": ["int"]},
+                {"name": "year", "dataType": ["int"], "indexRangeFilters": True},
                 {"name": "language", "dataType": ["text"]},
                 {"name": "type", "dataType": ["text"]},
                 {"name": "score", "dataType": ["number"]},
+                {"name": "content_hash", "dataType": ["text"]},
+                # Filterable metadata of API records (see sql.metadata.record_metadata).
+                # Field tokenization keeps values such as cube names whole for Equal/ContainsAny.
+                {"name": "cube", "dataType": ["text"], "tokenization": "field"},
+                {"name": "topic", "dataType": ["text"], "tokenization": "field"},
+                {"name": "period", "dataType": ["text"], "tokenization": "field"},
+                {"name": "quarter", "dataType": ["int"]},
+                {"name": "month", "dataType": ["int"]},
+                {"name": "city", "dataType": ["text"], "tokenization": "field"},
+                {"name": "sector", "dataType": ["text"], "tokenization": "field"},
             ]
         }
     ]
@@ -43,43 +75,247 @@ def get_weaviate_client():
         # Fallback to local Weaviate
         return weaviate.connect_to_local(skip_init_checks=True)
 
+def get_weaviate_async_client():
+    """Async counterpart of get_weaviate_client(). The client still needs to be connected."""
+    weaviate_url = os.getenv("WEAVIATE_URL")
+    weaviate_api_key = os.getenv("WEAVIATE_API_KEY")
+
+    if weaviate_url and weaviate_api_key:
+        return weaviate.use_async_with_weaviate_cloud(
+            cluster_url=weaviate_url,
+            auth_credentials=weaviate.auth.AuthApiKey(weaviate_api_key),
+            skip_init_checks=True
+        )
+    return weaviate.use_async_with_local(skip_init_checks=True)
+
+class WeaviateClientManager:
+    """Owns one long-lived async Weaviate client for the whole process.
+
+    The client keeps its HTTP and gRPC channels open between searches. It is
+    probed with is_ready() at most every HEALTH_CHECK_INTERVAL seconds and
+    transparently replaced when the probe fails or the connection drops.
+    """
+
+    def __init__(self, health_check_interval=HEALTH_CHECK_INTERVAL):
+        self.health_check_interval = health_check_interval
+        self._client = None
+        self._last_health_check = 0.0
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Open the shared client (no-op if it is already connected)."""
+        async with self._lock:
+            if self._client is None or not self._client.is_connected():
+                await self._open()
+        return self._client
+
+    async def _open(self):
+        await self._close_current()
+        client = get_weaviate_async_client()
+        try:
+            await client.connect()
+        except Exception:
+            await client.close()
+            raise
+        self._client = client
+        self._last_health_check = time.monotonic()
+        logger.info("Connected shared Weaviate client")
+
+    async def _close_current(self):
+        if self._client is not None:
+            try:
+                await self._client.close()
+            except Exception as e:
+                logger.warning(f"Error while closing Weaviate client: {e}")
+            self._client = None
+
+    async def get_client(self):
+        """Return a healthy client, reconnecting if the periodic probe fails."""
+        if self._client is None or not self._client.is_connected():
+            return await self.connect()
+
+        if time.monotonic() - self._last_health_check >= self.health_check_interval:
+            async with self._lock:
+                # Another caller may have probed or replaced the client while we waited
+                if time.monotonic() - self._last_health_check < self.health_check_interval:
+                    return self._client
+                try:
+                    healthy = await self._client.is_ready()
+                except Exception as e:
+                    logger.warning(f"Weaviate health check failed: {e}")
+                    healthy = False
+                if healthy:
+                    self._last_health_check = time.monotonic()
+                else:
+                    logger.warning("Weaviate client unhealthy, reconnecting...")
+                    await self._open()
+        return self._client
+
+    async def reconnect(self, failed_client):
+        """
+        Replaces `failed_client` after a failed request. When several requests
+        fail on the same client at once, only the first replaces it; the rest
+        get the new client instead of closing it under each other.
+        """
+        async with self._lock:
+            if self._client is failed_client or self._client is None:
+                await self._open()
+        return self._client
+
+    async def close(self):
+        async with self._lock:
+            await self._close_current()
+            logger.info("Closed shared Weaviate client")
+
+weaviate_manager = WeaviateClientManager()
+
+DATA_TYPES = {"text": DataType.TEXT, "int": DataType.INT, "number": DataType.NUMBER}
+# Chunk keys stored as object properties
+CHUNK_PROPERTIES = [prop["name"] for prop in SCHEMA["classes"][0]["properties"]]
+
 def create_schema():
     client = get_weaviate_client()
     try:
         existing = client.collections.list_all()
         if "Chunk" not in existing:
             client.collections.create_from_dict(SCHEMA["classes"][0])
+            return
+
+        # Add properties introduced after the collection was first created
+        collection = client.collections.get("Chunk")
+        current = {prop.name for prop in collection.config.get().properties}
+        for prop in SCHEMA["classes"][0]["properties"]:
+            if prop["name"] not in current:
+                collection.config.add_property(Property(
+                    name=prop["name"],
+                    data_type=DATA_TYPES[prop["dataType"][0]],
+                    tokenization=Tokenization(prop["tokenization"]) if "tokenization" in prop else None,
+                    index_range_filters=prop.get("indexRangeFilters"),
+                ))
     finally:
         client.close()
 
-def upload_chunks_with_embeddings(json_path):
+def chunk_id(content_hash):
+    """Deterministic object UUID for a chunk, so re-uploads overwrite instead of duplicating."""
+    return str(generate_uuid5(content_hash))
+
+def get_existing_chunk_ids():
+    """Returns {object uuid: source} for every stored chunk."""
     client = get_weaviate_client()
     try:
         collection = client.collections.get("Chunk")
-        with open(json_path, encoding="utf-8") as f:
-            chunks = json.load(f)
-        
-        with collection.batch.dynamic() as batch:
-            for chunk in chunks:
-                if chunk.get("embedding") is None:
-                    continue
-                
-                properties={
-                    "text": chunk["text"],
-                    "source": chunk.get("source"),
-                    "year": chunk.get("year"),
-                    "language": chunk.get("language"),
-                    "type": chunk.get("type"),
-                    "score": chunk.get("score", 1.0)
-                }
-                
-                batch.add_object(
-                    properties=properties,
-                    vector=np.array(chunk["embedding"], dtype=np.float32)
-                )
+        return {
+            str(obj.uuid): obj.properties.get("source")
+            for obj in collection.iterator(return_properties=["source"])
+        }
+    finally:
+        client.close()
+
+def delete_chunks(ids, batch_size=5000):
+    client = get_weaviate_client()
+    try:
+        collection = client.collections.get("Chunk")
+        for start in range(0, len(ids), batch_size):
+            collection.data.delete_many(
+                where=Filter.by_id().contains_any(ids[start:start + batch_size])
+            )
     finally:
         client.close()
 
+def count_chunks():
+    client = get_weaviate_client()
+    try:
+        return client.collections.get("Chunk").aggregate.over_all(total_count=True).total_count
+    finally:
+        client.close()
+
+def _chunk_object(chunk):
+    return {
+        "properties": {
+            **{name: chunk.get(name) for name in CHUNK_PROPERTIES},
+            "score": chunk.get("score", 1.0),
+        },
+        "uuid": chunk_id(chunk["content_hash"]) if chunk.get("content_hash") else None,
+        "vector": np.asarray(chunk["embedding"], dtype=np.float32),
+    }
+
+def _write_objects(collection, objects):
+    """One pass of fixed-size batches, UPLOAD_CONCURRENCY requests at a time. Returns the failures."""
+    with collection.batch.fixed_size(batch_size=UPLOAD_BATCH_OBJECTS, concurrent_requests=UPLOAD_CONCURRENCY) as batch:
+        for obj in objects:
+            batch.add_object(**obj)
+    return collection.batch.failed_objects
+
+def upsert_chunks(client, chunks):
+    """
+    Uploads chunks (dicts with an 'embedding') through an open sync client.
+
+    Objects Weaviate rejects are sent again, with capped exponential backoff,
+    up to UPLOAD_MAX_ATTEMPTS times in all. Returns how many still failed.
+    """
+    collection = client.collections.get("Chunk")
+    objects = [_chunk_object(chunk) for chunk in chunks if chunk.get("embedding") is not None]
+    for attempt in range(UPLOAD_MAX_ATTEMPTS):
+        if attempt:
+            UPSTREAM_RETRIES.labels("weaviate").inc()
+            time.sleep(min(2 ** attempt, UPLOAD_MAX_BACKOFF) + random.uniform(0, 1))
+        failed = _write_objects(collection, objects)
+        if not failed:
+            return 0
+        logger.warning(
+            f"{len(failed)} of {len(objects)} objects were not written "
+            f"(attempt {attempt + 1}/{UPLOAD_MAX_ATTEMPTS}): {failed[0].message}"
+        )
+        objects = [
+            {"properties": f.object_.properties, "uuid": f.object_.uuid, "vector": f.object_.vector}
+            for f in failed
+        ]
+    logger.error(f"Giving up on {len(objects)} objects after {UPLOAD_MAX_ATTEMPTS} attempts")
+    UPSTREAM_ERRORS.labels("weaviate", "upload").inc()
+    return len(objects)
+
+def upload_chunks_with_embeddings(embedded_dir=EMBEDDED_DIR):
+    """Uploads an embeddings checkpoint, reading vectors straight from the mapped file."""
+    checkpoint = EmbeddingCheckpoint(embedded_dir)
+    checkpoint.open()
+    client = get_weaviate_client()
+    sent = failed = 0
+    started = time.perf_counter()
+    try:
+        for batch in checkpoint.iter_batches():
+            failed += upsert_chunks(client, batch)
+            # upsert_chunks skips chunks without an embedding
+            sent += sum(chunk.get("embedding") is not None for chunk in batch)
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - started
+    uploaded = sent - failed
+    logger.info(
+        f"Uploaded {uploaded} objects in {elapsed:.1f}s "
+        f"({uploaded / elapsed if elapsed else 0:.0f} objects/s), {failed} failed"
+    )
+    return failed
+
+FILTER_METHODS = {
+    "Equal": "equal",
+    "NotEqual": "not_equal",
+    "GreaterThan": "greater_than",
+    "GreaterThanEqual": "greater_or_equal",
+    "LessThan": "less_than",
+    "LessThanEqual": "less_or_equal",
+    "ContainsAny": "contains_any",
+}
+
+def _build_filter(where):
+    """Translates a vectordb.filters dict into a Weaviate filter."""
+    operator = where["operator"]
+    if operator in ("And", "Or"):
+        operands = [_build_filter(operand) for operand in where["operands"]]
+        return Filter.all_of(operands) if operator == "And" else Filter.any_of(operands)
+    if operator not in FILTER_METHODS:
+        raise NotImplementedError(f"Unsupported filter operator: {operator}")
+    return getattr(Filter.by_property(where["path"][-1]), FILTER_METHODS[operator])(value_of(where))
+
 def search_chunks(query_embedding, top_k=10, where=None):
     client = get_weaviate_client()
     try:
@@ -92,11 +328,7 @@ def search_chunks(query_embedding, top_k=10, where=None):
         }
 
         if where:
-            if where["operator"] == "Equal":
-                my_filter = Filter.by_property(where["path"][-1]).equal(where["valueText"])
-                query_params["filters"] = my_filter
-            else:
-                raise NotImplementedError("Only 'Equal' operator is implemented in this example.")
+            query_params["filters"] = _build_filter(where)
         
         results = collection.query.near_vector(**query_params)
         
@@ -107,3 +339,35 @@ def search_chunks(query_embedding, top_k=10, where=None):
         return out
     finally:
         client.close()
+
+async def search_chunks_async(query_embedding, top_k=10, where=None, include_vector=False):
+    """Same as search_chunks() but runs on the shared async client.
+
+    With include_vector, each result also carries the stored 'vector'.
+    """
+    query_params = {
+        "near_vector": query_embedding,
+        "limit": top_k,
+        "return_metadata": MetadataQuery(distance=True),
+        "include_vector": include_vector,
+    }
+    if where:
+        query_params["filters"] = _build_filter(where)
+
+    client = await weaviate_manager.get_client()
+    try:
+        results = await client.collections.get("Chunk").query.near_vector(**query_params)
+    except (WeaviateConnectionError, WeaviateClosedClientError, WeaviateGRPCUnavailableError) as e:
+        # The channel went away between health checks; retry once on a fresh one
+        logger.warning(f"Weaviate search failed ({e}), reconnecting and retrying")
+        UPSTREAM_RETRIES.labels("weaviate").inc()
+        client = await weaviate_manager.reconnect(client)
+        results = await client.collections.get("Chunk").query.near_vector(**query_params)
+
+    out = []
+    for obj in results.objects:
+        result = {"properties": obj.properties, "distance": obj.metadata.distance}
+        if include_vector:
+            result["vector"] = obj.vector.get("default")
+        out.append(result)
+    return out